@@ -0,0 +1,79 @@
+"""Cost and accuracy of the HeadingPipeline (calibration + tilt + smoothing + incremental fit).
+
+Usage: python bench_calibration.py [--rate 1000] [--seconds 60] [--batches 1 10 50] [--motions tumble flat]
+Feeds a synthetic distorted 3-axis field through the pipeline in batches the size a reader
+would see at `rate` Hz, for a sensor tumbling a little ("tumble") or turned flat on a table
+("flat", Z only changes by noise and soft-iron cross-talk), and prints JSON: CPU seconds per second of input (must stay well below
+1 to keep up) and the heading error before and after calibration.
+"""
+import argparse
+import json
+import time
+import numpy as np
+from calibration import EllipsoidFitter, HeadingPipeline
+from sensor_module import compute_headings
+
+SOFT_IRON = np.array([[1.15, 0.08, 0.02], [0.08, 0.88, 0.04], [0.02, 0.04, 1.0]])
+HARD_IRON = np.array([60.0, -35.0, 20.0])
+
+
+def synthetic_field(samples, seed=0, motion="tumble"):
+    """True headings and raw X/Y/Z from a sensor turning in a distorted field."""
+    rng = np.random.default_rng(seed)
+    heading = np.linspace(0, 20 * 360, samples) % 360
+    if motion == "flat":
+        dip = np.full(samples, 0.3)
+    else:
+        dip = rng.uniform(-0.5, 0.5, samples)
+    angle = np.radians(heading)
+    true = np.column_stack((np.cos(angle) * np.cos(dip), np.sin(angle) * np.cos(dip), np.sin(dip))) * 400
+    raw = true @ np.linalg.inv(SOFT_IRON).T + HARD_IRON + rng.normal(0, 1.0, (samples, 3))
+    return heading, raw
+
+
+def angle_error(a, b):
+    return np.abs((a - b + 180) % 360 - 180)
+
+
+def run(rate, seconds, batch, window, motion="tumble"):
+    heading, raw = synthetic_field(int(rate * seconds), motion=motion)
+    pipeline = HeadingPipeline(window=window, fitter=EllipsoidFitter(window=2000))
+    outputs = []
+    start = time.process_time()
+    for i in range(0, len(raw), batch):
+        outputs.append(pipeline.process(raw[i:i + batch]))
+    cpu = time.process_time() - start
+    result = np.concatenate(outputs)
+
+    settled = slice(len(raw) // 2, None)  # after the fit has converged
+    before = angle_error(compute_headings(raw[:, 0], raw[:, 1]), heading)[settled]
+    after = angle_error(result, heading)[settled]
+    return {
+        "motion": motion,
+        "rate_hz": rate,
+        "batch": batch,
+        "smoothing_window": window,
+        "samples": len(raw),
+        "cpu_s_per_s_of_input": cpu / seconds,
+        "us_per_sample": cpu / len(raw) * 1e6,
+        "raw_error_deg_p95": float(np.percentile(before, 95)),
+        "calibrated_error_deg_p95": float(np.percentile(after, 95)),
+        "offset_found": pipeline.calibration.offset.round(2).tolist(),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rate", type=float, default=1000.0)
+    parser.add_argument("--seconds", type=float, default=60.0)
+    parser.add_argument("--batches", type=int, nargs="+", default=[1, 10, 50])
+    parser.add_argument("--window", type=int, default=5, help="smoothing window")
+    parser.add_argument("--motions", nargs="+", choices=("tumble", "flat"), default=["tumble", "flat"])
+    args = parser.parse_args()
+    results = [run(args.rate, args.seconds, batch, args.window, motion)
+               for motion in args.motions for batch in args.batches]
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,153 @@
+"""Fan-out benchmark: how many subscribers one core of FanoutServer can feed.
+
+Usage: python bench_fanout.py [--clients 10 100 500] [--sensors 4] [--rate 100] [--duration 5]
+The server runs in its own process and publishes `sensors` streams at `rate` Hz each; client
+processes subscribe over localhost TCP. Prints JSON per run: server CPU, clients per core
+(clients / server CPU fraction), samples delivered vs. expected, frames dropped and
+publish-to-receive latency percentiles.
+"""
+import argparse
+import json
+import multiprocessing
+import resource
+import selectors
+import socket
+import time
+import numpy as np
+from fanout_server import FanoutServer, FrameReader, SAMPLES, decode_samples
+from sensor_module import SAMPLE_DTYPE
+
+
+def cpu_seconds():
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return usage.ru_utime + usage.ru_stime
+
+
+def serve(sensors, rate, batch_interval, connection):
+    # Child process: only the server's CPU time is measured
+    server = FanoutServer(port=0, batch_interval=batch_interval)
+    ids = [server.add_name(f"sensor{i}") for i in range(sensors)]
+    connection.send(server.address)
+    duration = connection.recv()  # clients are connected
+    interval = 1.0 / rate
+    sample = np.zeros(1, dtype=SAMPLE_DTYPE)
+    cpu_start = cpu_seconds()
+    ticks = 0
+    start = next_tick = time.monotonic()
+    while next_tick - start < duration:
+        ticks += 1
+        for sensor_id in ids:
+            sample["timestamp"] = time.monotonic()
+            sample["heading"] = (next_tick - start) * 36.0 % 360.0
+            server.publish(sensor_id, sample.copy())
+        next_tick += interval
+        delay = next_tick - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+    time.sleep(2 * batch_interval)  # last batch out
+    cpu = cpu_seconds() - cpu_start
+    wall = time.monotonic() - start
+    dropped = server.frames_dropped
+    server.stop()
+    connection.send({"cpu_s": cpu, "wall_s": wall, "ticks": ticks, "frames_dropped": dropped})
+
+
+def subscribe_many(address, count, ready, connection):
+    # Child process: `count` subscribers multiplexed on one selector
+    selector = selectors.DefaultSelector()
+    for _ in range(count):
+        sock = socket.create_connection(address)
+        sock.setblocking(False)
+        selector.register(sock, selectors.EVENT_READ, FrameReader())
+    ready.set()
+    received = 0
+    latencies = []
+    open_sockets = count
+    while open_sockets:
+        for key, _ in selector.select(1.0):
+            try:
+                data = key.fileobj.recv(65536)
+            except BlockingIOError:
+                continue
+            if not data:
+                selector.unregister(key.fileobj)
+                key.fileobj.close()
+                open_sockets -= 1
+                continue
+            now = time.time()
+            for kind, _, payload in key.data.feed(data):
+                if kind == SAMPLES:
+                    samples = decode_samples(payload)
+                    received += len(samples)
+                    if len(latencies) < 100000:
+                        latencies.extend((now - samples["time"]) * 1000.0)
+    connection.send((received, np.array(latencies)))
+
+
+def run(clients, sensors, rate, duration, batch_interval, workers):
+    server_end, server_conn = multiprocessing.Pipe()
+    server = multiprocessing.Process(target=serve, args=(sensors, rate, batch_interval, server_conn))
+    server.start()
+    address = server_end.recv()
+
+    readers = []
+    processes = []
+    for index in range(workers):
+        count = clients // workers + (1 if index < clients % workers else 0)
+        if not count:
+            continue
+        ready = multiprocessing.Event()
+        receiver, sender = multiprocessing.Pipe(duplex=False)
+        process = multiprocessing.Process(target=subscribe_many, args=(address, count, ready, sender))
+        process.start()
+        ready.wait()
+        readers.append(receiver)
+        processes.append(process)
+    time.sleep(0.5)  # let the server accept everyone
+
+    server_end.send(duration)
+    result = server_end.recv()
+    server.join()
+    received = 0
+    latencies = []
+    for receiver in readers:
+        count, values = receiver.recv()
+        received += count
+        latencies.append(values)
+    for process in processes:
+        process.join()
+    latencies = np.concatenate(latencies) if latencies else np.empty(0)
+
+    expected = result["ticks"] * sensors * clients
+    cpu_fraction = result["cpu_s"] / result["wall_s"]
+    return {
+        "clients": clients,
+        "sensors": sensors,
+        "rate_hz": rate,
+        "batch_ms": batch_interval * 1000.0,
+        "server_cpu_percent": 100.0 * cpu_fraction,
+        "clients_per_core": clients / cpu_fraction if cpu_fraction else None,
+        "samples_expected": expected,
+        "samples_received": received,
+        "frames_dropped": result["frames_dropped"],
+        "latency_p50_ms": float(np.percentile(latencies, 50)) if len(latencies) else None,
+        "latency_p99_ms": float(np.percentile(latencies, 99)) if len(latencies) else None,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--clients", type=int, nargs="+", default=[10, 100, 500])
+    parser.add_argument("--sensors", type=int, default=4)
+    parser.add_argument("--rate", type=float, default=100.0, help="samples per second per sensor")
+    parser.add_argument("--duration", type=float, default=5.0)
+    parser.add_argument("--batch-ms", type=float, default=20.0)
+    parser.add_argument("--workers", type=int, default=4, help="client processes")
+    args = parser.parse_args()
+    for clients in args.clients:
+        result = run(clients, args.sensors, args.rate, args.duration, args.batch_ms / 1000.0, args.workers)
+        print(json.dumps(result), flush=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,138 @@
+"""Reader CPU cost per port as the number of ports grows (Linux, uses pseudo-terminals).
+
+Usage: python bench_multiport.py [--ports 1 2 4 8 16 32] [--rate 100] [--duration 3] [--mode both]
+Prints one JSON object per run on stdout (JSON lines; connection messages go to stderr). "loop" is the shared SensorLoop, "threads" the old one
+thread per port with readline().
+"""
+import argparse
+import contextlib
+import json
+import math
+import multiprocessing
+import os
+import resource
+import sys
+import threading
+import time
+import serial
+from sensor_module import SensorModule
+from sensor_loop import SensorLoop
+
+
+def write_lines(masters, rate, duration):
+    # Child process, so its CPU time is not charged to the reader
+    interval = 1.0 / rate
+    next_tick = time.monotonic()
+    for i in range(int(rate * duration)):
+        angle = math.radians(i % 360)
+        line = f"X:{math.cos(angle) * 400:.2f}, Y:{math.sin(angle) * 400:.2f}, Z:-177.56\n".encode()
+        for master in masters:
+            os.write(master, line)
+        next_tick += interval
+        delay = next_tick - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+
+
+class ThreadReader:
+    """The previous model: one thread per port looping on readline()."""
+
+    def __init__(self, port):
+        self.count = 0
+        self.running = True
+        self.connection = serial.Serial(port, 115200, timeout=0.2)
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def run(self):
+        while self.running:
+            try:
+                line = self.connection.readline().decode("utf-8").strip()
+                if "X:" not in line or "," not in line:
+                    continue
+                x = float(line.split("X:")[1].split(",")[0].strip())
+                y = float(line.split("Y:")[1].split(",")[0].strip())
+            except (ValueError, UnicodeDecodeError):
+                continue
+            # Scalar math as the per-line reader did; NumPy per sample would overstate its cost
+            heading = math.atan2(y, x) * (180 / math.pi)
+            if heading < 0:
+                heading += 360
+            self.count += 1
+
+    def stop(self):
+        self.running = False
+        self.thread.join()
+        self.connection.close()
+
+
+def cpu_seconds():
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return usage.ru_utime + usage.ru_stime
+
+
+def run(mode, ports, rate, duration):
+    pairs = [os.openpty() for _ in range(ports)]
+    names = [os.ttyname(slave) for _, slave in pairs]
+    if mode == "loop":
+        loop = SensorLoop()
+        readers = [SensorModule(name, 115200, loop=loop) for name in names]
+        while not all(reader.connected for reader in readers):
+            time.sleep(0.01)
+    else:
+        readers = [ThreadReader(name) for name in names]
+
+    writer = multiprocessing.Process(target=write_lines, args=([m for m, _ in pairs], rate, duration))
+    cpu_start = cpu_seconds()
+    wall_start = time.monotonic()
+    writer.start()
+    writer.join()
+    time.sleep(0.3)  # let the readers drain
+    cpu = cpu_seconds() - cpu_start
+    wall = time.monotonic() - wall_start
+
+    if mode == "loop":
+        received = sum(reader.samples.count for reader in readers)
+        for reader in readers:
+            reader.stop()
+        loop.stop()
+    else:
+        received = sum(reader.count for reader in readers)
+        for reader in readers:
+            reader.stop()
+    for master, slave in pairs:
+        os.close(master)
+        os.close(slave)
+
+    sent = ports * int(rate * duration)
+    return {
+        "mode": mode,
+        "ports": ports,
+        "rate_hz": rate,
+        "duration_s": duration,
+        "samples_sent": sent,
+        "samples_received": received,
+        "cpu_s": cpu,
+        "cpu_percent": 100.0 * cpu / wall,
+        "cpu_percent_per_port": 100.0 * cpu / wall / ports,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--ports", type=int, nargs="+", default=[1, 2, 4, 8, 16, 32])
+    parser.add_argument("--rate", type=float, default=100.0, help="lines per second per port")
+    parser.add_argument("--duration", type=float, default=3.0)
+    parser.add_argument("--mode", choices=["loop", "threads", "both"], default="both")
+    args = parser.parse_args()
+
+    modes = ["loop", "threads"] if args.mode == "both" else [args.mode]
+    for ports in args.ports:
+        for mode in modes:
+            with contextlib.redirect_stdout(sys.stderr):
+                result = run(mode, ports, args.rate, args.duration)
+            print(json.dumps(result), flush=True)
+
+
+if __name__ == "__main__":
+    main()
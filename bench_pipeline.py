@@ -0,0 +1,244 @@
+"""Throughput and latency benchmark for the sensor pipeline, no hardware needed (Linux, uses ptys).
+
+Usage: python bench_pipeline.py [--rates 100 1000 5000] [--duration 3] [--render] [--output results.json]
+
+Reports, as JSON:
+  parse    - lines/s through SensorModule.feed() vs. the old readline/split parser
+  pipeline - per input rate: samples sent/received/dropped, process CPU, reader (SensorLoop
+             thread) CPU and reader CPU per 1 kHz of input, latency percentiles from write() to get_degree() visibility and, with
+             --render, from write() to the painted frame
+The writer runs in a child process. With --render the process CPU also includes painting; the
+UI is built before the measurement starts.
+Only the JSON goes to stdout, connection messages go to stderr.
+"""
+import argparse
+import contextlib
+import json
+import math
+import multiprocessing
+import os
+import resource
+import sys
+import time
+import numpy as np
+from sensor_module import SensorModule
+from sensor_loop import SensorLoop
+from simulator import Simulator
+
+
+def percentiles(values_ms):
+    if not len(values_ms):
+        return {}
+    values = np.asarray(values_ms)
+    return {
+        "p50_ms": float(np.percentile(values, 50)),
+        "p90_ms": float(np.percentile(values, 90)),
+        "p99_ms": float(np.percentile(values, 99)),
+        "max_ms": float(values.max()),
+    }
+
+
+def cpu_seconds():
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return usage.ru_utime + usage.ru_stime
+
+
+def thread_cpu_seconds(thread):
+    return time.clock_gettime(time.pthread_getcpuclockid(thread.ident))
+
+
+def legacy_parse(line_bytes):
+    """The per-line parser SensorModule used before batch parsing."""
+    try:
+        line = line_bytes.decode("utf-8").strip()
+    except UnicodeDecodeError:
+        return None
+    if "X:" not in line or "," not in line:
+        return None
+    try:
+        x = float(line.split("X:")[1].split(",")[0].strip())
+        y = float(line.split("Y:")[1].split(",")[0].strip())
+    except ValueError:
+        return None
+    heading = math.atan2(y, x) * (180 / math.pi)
+    if heading < 0:
+        heading += 360
+    return heading
+
+
+def bench_parse(lines, malformed, chunk_size=4096):
+    simulator = Simulator(rate=1000, noise=2.0, malformed=malformed, seed=1)
+    data = b"".join(simulator.line() for _ in range(lines))
+    chunks = [data[i:i + chunk_size] for i in range(0, len(data), chunk_size)]
+
+    sensor = SensorModule("loop://", loop=SensorLoop())
+    start = time.perf_counter()
+    for chunk in chunks:
+        sensor.feed(chunk)
+    batch_time = time.perf_counter() - start
+    parsed = sensor.samples.count
+    sensor.loop.stop()
+
+    start = time.perf_counter()
+    legacy = sum(1 for line in data.splitlines(keepends=True) if legacy_parse(line) is not None)
+    legacy_time = time.perf_counter() - start
+
+    return {
+        "lines": lines,
+        "malformed_ratio": malformed,
+        "chunk_bytes": chunk_size,
+        "batch_lines_per_s": lines / batch_time,
+        "batch_samples": parsed,
+        "legacy_lines_per_s": lines / legacy_time,
+        "legacy_samples": legacy,
+        "speedup": legacy_time / batch_time,
+    }
+
+
+def simulate(master, rate, duration, burst, connection):
+    # Child process: its CPU time is not charged to the reader being measured
+    simulator = Simulator(rate=rate, burst=burst, noise=2.0, seed=2)
+    simulator.write = lambda data: os.write(master, data)
+    simulator.track_times = True
+    simulator.run(duration=duration)
+    connection.send(np.array(simulator.send_times))
+    connection.close()
+
+
+def bench_rate(rate, duration, burst, render):
+    master, slave = os.openpty()
+    loop = SensorLoop()
+    sensor = SensorModule(os.ttyname(slave), 921600, buffer_size=max(4096, int(rate * duration) + 1), loop=loop)
+    while not sensor.connected:
+        time.sleep(0.01)
+
+    arrivals = []  # (sample count after the batch, time it became visible to get_degree())
+    sensor.add_listener(lambda s: arrivals.append((s.samples.count, time.monotonic())))
+
+    receiver, sender = multiprocessing.Pipe(duplex=False)
+    writer = multiprocessing.Process(target=simulate, args=(master, rate, duration, burst, sender))
+
+    painted = []
+    ui = build_ui(sensor, painted) if render else None
+    cpu_start = cpu_seconds()
+    reader_start = thread_cpu_seconds(loop.thread)
+    wall_start = time.monotonic()
+    writer.start()
+    if ui:
+        run_ui(ui, receiver)
+    send_times = receiver.recv()
+    writer.join()
+    time.sleep(0.2)  # let the reader drain
+    cpu = cpu_seconds() - cpu_start
+    reader_cpu = thread_cpu_seconds(loop.thread) - reader_start
+    wall = time.monotonic() - wall_start
+
+    sensor.stop()
+    loop.stop()
+    os.close(master)
+    os.close(slave)
+
+    latencies = []
+    previous = 0
+    for count, visible in arrivals:
+        sent = send_times[previous:min(count, len(send_times))]
+        latencies.extend((visible - sent) * 1000.0)
+        previous = count
+    render_latencies = [(when - send_times[index]) * 1000.0 for index, when in painted if index < len(send_times)]
+
+    received = sensor.samples.count
+    result = {
+        "rate_hz": rate,
+        "burst": burst,
+        "duration_s": duration,
+        "samples_sent": len(send_times),
+        "samples_received": received,
+        "samples_dropped": max(0, len(send_times) - received),
+        "cpu_percent": 100.0 * cpu / wall,
+        "reader_cpu_percent": 100.0 * reader_cpu / wall,
+        "cpu_percent_per_khz": 100.0 * reader_cpu / wall / (rate / 1000.0),
+        "write_to_get_degree": percentiles(latencies),
+    }
+    if render:
+        result["write_to_paint"] = percentiles(render_latencies)
+        result["frames_painted"] = len(painted)
+    return result
+
+
+def build_ui(sensor, painted):
+    """CompassWidget fed through SensorBridge; paints append (sample index, paint time) to `painted`."""
+    os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+    from PyQt5.QtWidgets import QApplication
+    from bench_render import load_images
+    from compass_widget import CompassWidget
+    from sensor_bridge import SensorBridge
+
+    app = QApplication.instance() or QApplication(sys.argv)
+
+    class TimedCompass(CompassWidget):
+        index = None
+
+        def paintEvent(self, event):
+            super().paintEvent(event)
+            if self.index is not None:
+                painted.append((self.index, time.monotonic()))
+                self.index = None
+
+    circle, needle = load_images()
+    widget = TimedCompass(circle, needle, resolution=0.1)
+    # No background rendering inside the measured window
+    widget.precompute_timer.stop()
+    widget.show()
+    app.processEvents()
+
+    def on_heading(heading, timestamp):
+        # Newest sample when the bridge delivered; the heading shown belongs to it
+        widget.index = sensor.samples.count - 1
+        widget.set_heading(heading, timestamp)
+
+    bridge = SensorBridge(sensor, max_fps=1000)
+    bridge.heading_changed.connect(on_heading)
+    return app, widget, bridge
+
+
+def run_ui(ui, receiver):
+    """Run the event loop until the writer reports back, then close the UI."""
+    from PyQt5.QtCore import QTimer
+
+    app, widget, bridge = ui
+    timer = QTimer()
+    timer.timeout.connect(lambda: app.quit() if receiver.poll() else None)
+    timer.start(50)
+    app.exec_()
+    timer.stop()
+    bridge.close()
+    widget.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rates", type=float, nargs="+", default=[100.0, 1000.0, 5000.0])
+    parser.add_argument("--duration", type=float, default=3.0)
+    parser.add_argument("--burst", type=int, default=1, help="lines per write in the pipeline runs")
+    parser.add_argument("--parse-lines", type=int, default=200000)
+    parser.add_argument("--malformed", type=float, default=0.01, help="malformed ratio for the parse run")
+    parser.add_argument("--render", action="store_true", help="also measure write-to-paint (offscreen Qt)")
+    parser.add_argument("--output", help="write the JSON here as well as to stdout")
+    args = parser.parse_args()
+
+    with contextlib.redirect_stdout(sys.stderr):
+        results = {
+            "timestamp": time.time(),
+            "python": sys.version.split()[0],
+            "parse": bench_parse(args.parse_lines, args.malformed),
+            "pipeline": [bench_rate(rate, args.duration, args.burst, args.render) for rate in args.rates],
+        }
+    text = json.dumps(results, indent=2)
+    print(text)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+
+
+if __name__ == "__main__":
+    main()
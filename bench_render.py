@@ -0,0 +1,109 @@
+"""Compare the per-tick QPixmap rotation path with the cached CompassWidget.
+
+Usage: python bench_render.py [--frames 2000] [--rotate needle] [--resolution DEG]
+Without --resolution the widget picks the finest step whose full turn fits its cache budget.
+The widget's frames are precomputed first (reported as precompute_s), as the idle timer
+would do after startup. Runs headless with QT_QPA_PLATFORM=offscreen if no platform is set.
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import time
+
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+
+from PyQt5.QtWidgets import QApplication, QLabel
+from PyQt5.QtGui import QPixmap, QPainter
+from PyQt5.QtCore import Qt
+from compass_widget import CompassWidget, FrameStats, rotate_pixmap, centered_layer
+from main import resource_path
+
+
+def heading_sequence(frames, seed=1):
+    # Slow drift with sensor noise, like a compass sitting on a bench
+    rng = random.Random(seed)
+    heading = 0.0
+    for _ in range(frames):
+        heading = (heading + rng.gauss(0.2, 0.3)) % 360
+        yield heading
+
+
+def load_images():
+    circle = QPixmap(resource_path(os.path.join("images", "compass_circle.png")))
+    needle = QPixmap(resource_path(os.path.join("images", "compass_needle.png")))
+    needle = needle.scaled(needle.size() * 0.8, Qt.KeepAspectRatio, Qt.SmoothTransformation)
+    return circle, needle
+
+
+def bench_legacy(circle, needle, headings):
+    combined = QPixmap(circle)
+    layer = centered_layer(circle.size(), needle)
+    painter = QPainter(combined)
+    painter.drawPixmap(0, 0, layer)
+    painter.end()
+
+    label = QLabel()
+    label.setFixedSize(circle.size())
+    label.show()
+    QApplication.processEvents()
+    stats = FrameStats(window=len(headings))
+    start = time.perf_counter()
+    for heading in headings:
+        tick = time.perf_counter()
+        label.setPixmap(rotate_pixmap(combined, -heading))
+        label.repaint()
+        stats.add(time.perf_counter() - tick)
+    total = time.perf_counter() - start
+    result = stats.summary()
+    result["total_s"] = total
+    return result
+
+
+def bench_widget(circle, needle, headings, rotate, resolution):
+    widget = CompassWidget(circle, needle, rotate=rotate, resolution=resolution)
+    widget.precompute_timer.stop()
+    start = time.perf_counter()
+    widget.cache.precompute()
+    precompute = time.perf_counter() - start
+    widget.show()
+    QApplication.processEvents()
+    widget.stats = FrameStats(window=len(headings))
+    start = time.perf_counter()
+    for heading in headings:
+        if widget.set_heading(heading):
+            widget.repaint()
+    total = time.perf_counter() - start
+    result = widget.frame_stats()
+    result.update({
+        "total_s": total,
+        "rotate": rotate,
+        "resolution": widget.cache.resolution,
+        "precompute_s": precompute,
+        "cache_mb": len(widget.cache) * widget.cache.pixmap.width() * widget.cache.pixmap.height() * 4 / 2 ** 20,
+    })
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--frames", type=int, default=2000)
+    parser.add_argument("--rotate", choices=("all", "dial", "needle"), default="needle")
+    parser.add_argument("--resolution", type=float, default=None, help="display step in degrees")
+    args = parser.parse_args()
+
+    app = QApplication(sys.argv)
+    circle, needle = load_images()
+    headings = list(heading_sequence(args.frames))
+    results = {
+        "frames": args.frames,
+        "legacy": bench_legacy(circle, needle, headings),
+        "widget": bench_widget(circle, needle, headings, args.rotate, args.resolution),
+    }
+    print(json.dumps(results, indent=2))
+    app.quit()
+
+
+if __name__ == "__main__":
+    main()
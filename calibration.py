@@ -0,0 +1,212 @@
+import json
+import numpy as np
+from sensor_module import compute_headings
+
+
+class Calibration:
+    """Hard-iron offset and soft-iron matrix: corrected = matrix @ (raw - offset)."""
+
+    def __init__(self, matrix=None, offset=None):
+        self.matrix = np.eye(3) if matrix is None else np.asarray(matrix, dtype=np.float64)
+        self.offset = np.zeros(3) if offset is None else np.asarray(offset, dtype=np.float64)
+
+    def apply(self, xyz):
+        return (xyz - self.offset) @ self.matrix.T
+
+    def to_dict(self):
+        return {"matrix": self.matrix.tolist(), "offset": self.offset.tolist()}
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data.get("matrix"), data.get("offset"))
+
+
+def load_settings(path):
+    """Read a JSON file with optional "matrix", "offset", "pitch", "roll" and "window" keys."""
+    with open(path) as f:
+        return json.load(f)
+
+
+class EllipsoidFitter:
+    """Incremental hard/soft-iron fit over the last `window` samples.
+
+    Keeps the least-squares normal equations of the quadric
+    a x² + b y² + c z² + 2f yz + 2g xz + 2h xy + 2p x + 2q y + 2r z = 1
+    and adds/subtracts the rows of samples entering/leaving the window, so each update costs
+    O(batch) instead of a refit of the whole window. The sums are rebuilt from the window
+    every `rebuild_every` updates to stop rounding drift. If Z is missing or its spread is below
+    `flat_ratio` of the X/Y spread (sensor turned flat), or the 3D fit is degenerate, a 2D ellipse
+    fit in X/Y is used instead.
+    """
+
+    def __init__(self, window=2000, min_samples=100, rebuild_every=500, flat_ratio=0.1):
+        self.window = window
+        self.flat_ratio = flat_ratio
+        self.min_samples = min_samples
+        self.rebuild_every = rebuild_every
+        self.points = np.zeros((window, 3))
+        self.count = 0
+        self.updates = 0
+        self.scale = None
+        self.normal = np.zeros((9, 9))
+        self.rhs = np.zeros(9)
+
+    @staticmethod
+    def design(points):
+        x, y, z = points[:, 0], points[:, 1], points[:, 2]
+        return np.column_stack((x * x, y * y, z * z, 2 * y * z, 2 * x * z, 2 * x * y, 2 * x, 2 * y, 2 * z))
+
+    def _accumulate(self, points, sign):
+        rows = self.design(points)
+        self.normal += sign * (rows.T @ rows)
+        self.rhs += sign * rows.sum(axis=0)
+
+    def _stored(self):
+        if self.count <= self.window:
+            return self.points[:self.count]
+        return self.points
+
+    def update(self, xyz):
+        xyz = np.asarray(xyz, dtype=np.float64)
+        xyz = xyz[np.isfinite(xyz[:, 0]) & np.isfinite(xyz[:, 1])]
+        if len(xyz) > self.window:
+            xyz = xyz[-self.window:]
+        if not len(xyz):
+            return
+        if self.scale is None:
+            # Work in roughly unit-sized coordinates to keep the normal equations well conditioned
+            self.scale = float(np.abs(xyz[:, :2]).max()) or 1.0
+        points = np.nan_to_num(xyz / self.scale)
+
+        n = len(points)
+        start = self.count % self.window
+        indices = (start + np.arange(n)) % self.window
+        overwritten = min(n, self.count + n - self.window)
+        if overwritten > 0:
+            # Free slots are filled first, so the slots holding old samples are the last ones
+            self._accumulate(self.points[indices[n - overwritten:]], -1.0)
+        self.points[indices] = points
+        self._accumulate(points, 1.0)
+        self.count += n
+
+        self.updates += 1
+        if self.updates % self.rebuild_every == 0:
+            self.normal[:] = 0
+            self.rhs[:] = 0
+            self._accumulate(self._stored(), 1.0)
+
+    def fit(self):
+        """Current Calibration, or None if there is not enough (or not usable) data."""
+        if self.count < self.min_samples:
+            return None
+        spread = np.ptp(self._stored(), axis=0)
+        if spread[2] < self.flat_ratio * spread[:2].max():
+            return self._fit_2d()
+        try:
+            v = np.linalg.solve(self.normal, self.rhs)
+        except np.linalg.LinAlgError:
+            return self._fit_2d()
+        a = np.array([[v[0], v[5], v[4]], [v[5], v[1], v[3]], [v[4], v[3], v[2]]])
+        # Noise on a nearly flat Z makes the quadric degenerate (not an ellipsoid)
+        return self._calibration(a, v[6:9]) or self._fit_2d()
+
+    def _fit_2d(self):
+        columns = [0, 1, 5, 6, 7]  # x², y², 2xy, 2x, 2y
+        try:
+            v = np.linalg.solve(self.normal[np.ix_(columns, columns)], self.rhs[columns])
+        except np.linalg.LinAlgError:
+            return None
+        a = np.array([[v[0], v[2]], [v[2], v[1]]])
+        calibration = self._calibration(a, v[3:5])
+        if calibration is None:
+            return None
+        matrix = np.eye(3)
+        matrix[:2, :2] = calibration.matrix
+        offset = np.zeros(3)
+        offset[:2] = calibration.offset
+        return Calibration(matrix, offset)
+
+    def _calibration(self, a, b):
+        try:
+            center = -np.linalg.solve(a, b)
+        except np.linalg.LinAlgError:
+            return None
+        eigenvalues, vectors = np.linalg.eigh(a)
+        if np.any(eigenvalues <= 0):
+            return None  # not an ellipsoid (too little rotation coverage so far)
+        root = vectors @ np.diag(np.sqrt(eigenvalues)) @ vectors.T
+        # Keep the average field magnitude: normalise to determinant 1
+        matrix = root / np.linalg.det(root) ** (1.0 / len(b))
+        return Calibration(matrix, center * self.scale)
+
+
+class HeadingPipeline:
+    """Batch heading computation: calibration, optional tilt compensation, circular smoothing.
+
+    pitch/roll  : fixed mounting tilt in degrees, compensated using Z (needs Z in the stream)
+    window      : circular moving average over this many samples (1 = off)
+    fitter      : EllipsoidFitter; its result replaces `calibration` every `refit_every` samples
+    """
+
+    def __init__(self, calibration=None, pitch=0.0, roll=0.0, window=1, fitter=None, refit_every=200):
+        self.calibration = calibration or Calibration()
+        self.window = max(1, int(window))
+        self.fitter = fitter
+        self.refit_every = refit_every
+        self._since_refit = 0
+        self._tail = np.empty((0, 2))
+        self.set_tilt(pitch, roll)
+
+    @classmethod
+    def from_settings(cls, settings, **kwargs):
+        return cls(Calibration.from_dict(settings), pitch=settings.get("pitch", 0.0),
+                   roll=settings.get("roll", 0.0), window=settings.get("window", 1), **kwargs)
+
+    def set_tilt(self, pitch, roll):
+        self.pitch = pitch
+        self.roll = roll
+        if not pitch and not roll:
+            self.tilt = None
+            return
+        p, r = np.radians(pitch), np.radians(roll)
+        # Rows give the horizontal X and Y components of the (calibrated) field vector
+        self.tilt = np.array([
+            [np.cos(p), np.sin(r) * np.sin(p), np.cos(r) * np.sin(p)],
+            [0.0, np.cos(r), -np.sin(r)],
+        ])
+
+    def smooth(self, headings):
+        if self.window == 1:
+            return headings
+        angles = np.radians(headings)
+        vectors = np.vstack((self._tail, np.column_stack((np.cos(angles), np.sin(angles)))))
+        sums = np.cumsum(vectors, axis=0)
+        sums = np.vstack((np.zeros((1, 2)), sums))
+        start = np.maximum(np.arange(len(self._tail) + 1, len(vectors) + 1) - self.window, 0)
+        windowed = sums[len(self._tail) + 1:] - sums[start]
+        self._tail = vectors[-(self.window - 1):]
+        return compute_headings(windowed[:, 0], windowed[:, 1])
+
+    def process(self, xyz):
+        """Headings in degrees for an (n, 3) array of raw X/Y/Z."""
+        if self.fitter is not None:
+            self.fitter.update(xyz)
+            self._since_refit += len(xyz)
+            if self._since_refit >= self.refit_every:
+                self._since_refit = 0
+                calibration = self.fitter.fit()
+                if calibration is not None:
+                    self.calibration = calibration
+        calibration = self.calibration
+        if np.isnan(xyz[:, 2]).any():
+            # Missing Z: treat it as centred so X/Y are still corrected
+            xyz = xyz.copy()
+            z = xyz[:, 2]
+            z[np.isnan(z)] = calibration.offset[2]
+        corrected = calibration.apply(xyz)
+        if self.tilt is not None:
+            horizontal = corrected @ self.tilt.T
+            headings = compute_headings(horizontal[:, 0], horizontal[:, 1])
+        else:
+            headings = compute_headings(corrected[:, 0], corrected[:, 1])
+        return self.smooth(headings)
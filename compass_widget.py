@@ -0,0 +1,304 @@
+import math
+import time
+from collections import OrderedDict, deque
+import numpy as np
+from PyQt5.QtWidgets import QWidget, QLabel
+from PyQt5.QtGui import QPixmap, QTransform, QPainter, QImage
+from PyQt5.QtCore import Qt, QTimer, QSize, pyqtSignal
+from metrics import registry
+
+PAINT_TIME = registry.histogram("ui.paint_ms")
+SAMPLE_AGE = registry.histogram("ui.sample_age_ms")
+
+
+def rotate_pixmap(pixmap, angle):
+    """Return a new pixmap with `pixmap` rotated by `angle` degrees around its center."""
+    rotated_pixmap = QPixmap(pixmap.size())
+    rotated_pixmap.fill(Qt.transparent)
+
+    painter = QPainter(rotated_pixmap)
+    painter.setRenderHint(QPainter.Antialiasing)
+
+    center = pixmap.rect().center()
+
+    transform = QTransform()
+    transform.translate(center.x(), center.y())
+    transform.rotate(angle)
+    transform.translate(-center.x(), -center.y())
+
+    painter.setTransform(transform)
+    painter.drawPixmap(0, 0, pixmap)
+    painter.end()
+    return rotated_pixmap
+
+
+def centered_layer(size, pixmap):
+    """Transparent pixmap of `size` with `pixmap` drawn in the middle."""
+    layer = QPixmap(size)
+    layer.fill(Qt.transparent)
+    painter = QPainter(layer)
+    painter.setRenderHint(QPainter.Antialiasing)
+    offset = layer.rect().center() - pixmap.rect().center()
+    painter.drawPixmap(offset.x(), offset.y(), pixmap)
+    painter.end()
+    return layer
+
+
+def opaque_radius(pixmap):
+    """Distance from the center of `pixmap` to its farthest non-transparent pixel."""
+    image = pixmap.toImage().convertToFormat(QImage.Format_ARGB32)
+    width, height = image.width(), image.height()
+    bits = image.constBits()
+    bits.setsize(image.byteCount())
+    alpha = np.frombuffer(bits, np.uint8).reshape(height, image.bytesPerLine() // 4, 4)[:, :width, 3]
+    ys, xs = np.nonzero(alpha)
+    if not len(xs):
+        return 0.0
+    # Pixel corners farthest from the center
+    dx = np.maximum(np.abs(xs - width / 2), np.abs(xs + 1 - width / 2))
+    dy = np.maximum(np.abs(ys - height / 2), np.abs(ys + 1 - height / 2))
+    return float(np.sqrt(dx * dx + dy * dy).max())
+
+
+def full_turn_resolution(frame_bytes, max_bytes, finest=1.0):
+    """Finest step (not below `finest` degrees, dividing 360) whose full turn fits in `max_bytes`."""
+    frames = max(1, min(int(round(360.0 / finest)), max_bytes // max(1, frame_bytes)))
+    return 360.0 / frames
+
+
+class FrameStats:
+    """Rolling paint-time statistics in milliseconds."""
+
+    def __init__(self, window=1000):
+        self.times = deque(maxlen=window)
+        self.count = 0
+
+    def add(self, seconds):
+        self.times.append(seconds * 1000.0)
+        self.count += 1
+
+    def summary(self):
+        if not self.times:
+            return {"frames": self.count}
+        ordered = sorted(self.times)
+        return {
+            "frames": self.count,
+            "mean_ms": sum(ordered) / len(ordered),
+            "p50_ms": ordered[len(ordered) // 2],
+            "p95_ms": ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))],
+            "max_ms": ordered[-1],
+        }
+
+
+class RotationCache:
+    """LRU cache of `pixmap` rotated in `resolution` degree steps, limited to `max_bytes`.
+
+    Step n is `pixmap` turned n * resolution degrees counterclockwise, which brings heading n
+    of a dial to the top; with clockwise=True it is turned clockwise, so a needle points at
+    heading n on a fixed dial. When a full turn fits in the budget, precompute() fills it and nothing is rotated while
+    painting. Widgets showing the same layer can share one cache.
+    """
+
+    def __init__(self, pixmap, resolution=1.0, max_bytes=32 * 1024 * 1024, clockwise=False):
+        self.pixmap = pixmap
+        self.resolution = resolution
+        self.clockwise = clockwise
+        self.steps = max(1, int(round(360.0 / resolution)))
+        frame_bytes = max(1, pixmap.width() * pixmap.height() * 4)
+        self.max_frames = max(1, max_bytes // frame_bytes)
+        self.frames = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self.frames)
+
+    def quantize(self, heading):
+        return int(round(heading / self.resolution)) % self.steps
+
+    def angle(self, step):
+        angle = step * self.resolution
+        return angle if self.clockwise else -angle
+
+    def get(self, step):
+        pixmap = self.frames.get(step)
+        if pixmap is not None:
+            self.frames.move_to_end(step)
+            self.hits += 1
+            return pixmap
+        self.misses += 1
+        pixmap = rotate_pixmap(self.pixmap, self.angle(step))
+        self.frames[step] = pixmap
+        if len(self.frames) > self.max_frames:
+            self.frames.popitem(last=False)
+        return pixmap
+
+    @property
+    def complete(self):
+        return len(self.frames) >= min(self.steps, self.max_frames)
+
+    def precompute(self, count=None):
+        """Render up to `count` (default: all) missing frames the budget allows. Returns True when done."""
+        stride = max(1, self.steps // self.max_frames)
+        for step in range(0, self.steps, stride):
+            if self.complete:
+                break
+            if step in self.frames:
+                continue
+            if count is not None:
+                if count <= 0:
+                    break
+                count -= 1
+            self.frames[step] = rotate_pixmap(self.pixmap, self.angle(step))
+        return self.complete
+
+
+class CompassWidget(QWidget):
+    """Compass that paints in paintEvent from a cache of pre-rotated frames.
+
+    rotate selects the layer that turns with the heading:
+      "all"    - dial and needle together (the original CompassApp look)
+      "dial"   - the dial turns under a fixed needle
+      "needle" - the needle turns clockwise over a fixed dial to point at the heading (default;
+                 only the needle's own bounding square is rotated and cached, a quarter of the
+                 memory of a whole-dial frame)
+    Headings are quantized to `resolution` degrees; changes smaller than that do not repaint.
+    Without a resolution the finest step (down to 1 degree) whose full turn fits in
+    `max_cache_bytes` is used, and the frames are rendered ahead from an idle timer, so painting
+    only copies pixmaps. An explicit finer resolution falls back to an LRU of rotated frames.
+    If set_heading() gets the sample's arrival time, the sample-to-paint latency is tracked too.
+    `cache` shares one RotationCache between widgets showing the same images.
+    """
+
+    first_frame = pyqtSignal()  # emitted after the first paint, for startup timing
+
+    def __init__(self, dial, needle, rotate="needle", resolution=None, max_cache_bytes=64 * 1024 * 1024,
+                 cache=None, parent=None):
+        super().__init__(parent)
+        if rotate not in ("all", "dial", "needle"):
+            raise ValueError(f"Unknown rotate mode: {rotate}")
+        self.setFixedSize(dial.size())
+
+        needle_layer = centered_layer(dial.size(), needle)
+        self.static_under = None
+        self.static_over = None
+        if rotate == "all":
+            # Draw the static dial+needle composition once
+            combined = QPixmap(dial)
+            painter = QPainter(combined)
+            painter.setRenderHint(QPainter.Antialiasing)
+            painter.drawPixmap(0, 0, needle_layer)
+            painter.end()
+            self.rotating = combined
+        elif rotate == "dial":
+            self.rotating = dial
+            self.static_over = needle_layer
+        else:
+            self.static_under = dial
+            side = 2 * math.ceil(opaque_radius(needle))
+            self.rotating = centered_layer(QSize(side, side), needle)
+
+        if cache is None:
+            if resolution is None:
+                frame_bytes = self.rotating.width() * self.rotating.height() * 4
+                resolution = full_turn_resolution(frame_bytes, max_cache_bytes)
+            cache = RotationCache(self.rotating, resolution, max_cache_bytes, clockwise=rotate == "needle")
+        self.cache = cache
+        self.offset_x = (self.width() - self.cache.pixmap.width()) // 2
+        self.offset_y = (self.height() - self.cache.pixmap.height()) // 2
+
+        # Render the rotated frames ahead, a few per event loop pass, off the paint path
+        self.precompute_timer = QTimer(self)
+        self.precompute_timer.timeout.connect(self.precompute_step)
+        if not self.cache.complete:
+            self.precompute_timer.start(0)
+
+        self.step = 0
+        self.heading = 0.0
+        self.timestamp = None
+        self.skipped_updates = 0
+        self.stats = FrameStats()
+        self.latency = FrameStats()
+
+    def precompute_step(self):
+        if self.cache.precompute(4):
+            self.precompute_timer.stop()
+
+    def set_heading(self, heading, timestamp=None):
+        """Schedule a repaint if the heading moved by at least one display step. Returns True if it did.
+
+        timestamp is the time.monotonic() arrival time of the sample, used for latency stats.
+        """
+        step = self.cache.quantize(heading)
+        self.heading = heading
+        if step == self.step:
+            self.skipped_updates += 1
+            return False
+        self.step = step
+        self.timestamp = timestamp
+        self.update()
+        return True
+
+    def paintEvent(self, event):
+        start = time.perf_counter()
+        painter = QPainter(self)
+        if self.static_under is not None:
+            painter.drawPixmap(0, 0, self.static_under)
+        painter.drawPixmap(self.offset_x, self.offset_y, self.cache.get(self.step))
+        if self.static_over is not None:
+            painter.drawPixmap(0, 0, self.static_over)
+        painter.end()
+        elapsed = time.perf_counter() - start
+        self.stats.add(elapsed)
+        PAINT_TIME.add(elapsed * 1000.0)
+        if self.stats.count == 1:
+            self.first_frame.emit()
+        if self.timestamp is not None:
+            age = time.monotonic() - self.timestamp
+            self.latency.add(age)
+            SAMPLE_AGE.add(age * 1000.0)
+            self.timestamp = None
+
+    def frame_stats(self):
+        stats = self.stats.summary()
+        stats.update({
+            "skipped_updates": self.skipped_updates,
+            "cache_frames": len(self.cache),
+            "cache_hits": self.cache.hits,
+            "cache_misses": self.cache.misses,
+            "latency": self.latency.summary(),
+        })
+        return stats
+
+
+class StatsOverlay(QLabel):
+    """Semi-transparent text box with the live pipeline metrics, refreshed every `interval_ms`."""
+
+    def __init__(self, interval_ms=500, parent=None):
+        super().__init__(parent)
+        self.setStyleSheet("background-color: rgba(0, 0, 0, 170); color: #9f9; font-family: monospace;"
+                           " font-size: 11px; padding: 4px;")
+        self.setAttribute(Qt.WA_TransparentForMouseEvents)
+        self.previous = registry.snapshot()
+        self.timer = QTimer(self)
+        self.timer.timeout.connect(self.refresh)
+        self.timer.start(interval_ms)
+        self.refresh()
+
+    def refresh(self):
+        snapshot = registry.snapshot(self.previous)
+        self.previous = snapshot
+        counters, rates, histograms = snapshot["counters"], snapshot["rates"], snapshot["histograms"]
+        lines = [
+            f"read     {rates.get('sensor.bytes', 0):8.0f} B/s  {rates.get('sensor.lines', 0):6.0f} lines/s",
+            f"errors   {counters.get('sensor.parse_errors', 0):8d} parse   {counters.get('sensor.dropped_bytes', 0):6d} B dropped",
+        ]
+        for name, label, unit in (("sensor.lock_wait_us", "lock wait", "us"),
+                                  ("ui.sample_age_ms", "age@paint", "ms"),
+                                  ("ui.paint_ms", "paint", "ms")):
+            summary = histograms.get(name, {"count": 0})
+            if summary["count"]:
+                lines.append(f"{label:<10}p50 <{summary['p50']:g} {unit}  p99 <{summary['p99']:g} {unit}"
+                             f"  max {summary['max']:.1f} {unit}")
+        self.setText("\n".join(lines))
+        self.adjustSize()
@@ -0,0 +1,440 @@
+"""Headless mode: read each port once and stream the samples to any number of local subscribers.
+
+Wire format (TCP, little endian), a sequence of frames:
+  header  : u8 kind, u16 sensor id, u32 payload length
+  kind 0  HELLO    payload is JSON {"version": 1, "sensors": [port names, index = sensor id]}
+  kind 1  SAMPLES  payload is n x (f64 wall-clock time, f32 x, f32 y, f32 z, f32 heading)
+  kind 2  DROPPED  payload is u32: SAMPLES frames this client lost since the previous notice
+Samples are collected for `batch_interval` seconds and each sensor's batch is encoded once and
+shared by all clients, so a client gets one send() per interval however many sensors there are.
+A client that does not keep up has its oldest queued frames dropped (never a partly sent one),
+so a slow subscriber can never stall the reader or the other clients.
+
+With --websocket PORT a separate process (bottle-websocket/gevent) relays the same frames as
+binary WebSocket messages, one or more whole frames per message.
+
+Usage: python fanout_server.py --ports COM3 COM4 [--host 127.0.0.1] [--port 8765] [--websocket 8766]
+       python fanout_server.py --simulate 4 --rate 100    (local stand-in, no hardware)
+       python fanout_server.py --connect 127.0.0.1:8765   (print what a subscriber receives)
+"""
+import argparse
+import json
+import multiprocessing
+import selectors
+import socket
+import struct
+import threading
+import time
+from collections import deque
+import numpy as np
+from sensor_module import SensorModule
+from metrics import registry, SnapshotExporter
+
+FRAME_HEADER = struct.Struct("<BHI")
+DROPPED_PAYLOAD = struct.Struct("<I")
+WIRE_DTYPE = np.dtype([
+    ("time", "<f8"),
+    ("x", "<f4"),
+    ("y", "<f4"),
+    ("z", "<f4"),
+    ("heading", "<f4"),
+])
+
+HELLO = 0
+SAMPLES = 1
+DROPPED = 2
+
+
+def encode_frame(kind, sensor_id, payload):
+    return FRAME_HEADER.pack(kind, sensor_id, len(payload)) + payload
+
+
+def encode_samples(sensor_id, samples, clock_offset):
+    """SAMPLES frame for a SAMPLE_DTYPE array; clock_offset turns monotonic into wall-clock time."""
+    wire = np.empty(len(samples), dtype=WIRE_DTYPE)
+    wire["time"] = samples["timestamp"] + clock_offset
+    for field in ("x", "y", "z", "heading"):
+        wire[field] = samples[field]
+    return encode_frame(SAMPLES, sensor_id, wire.tobytes())
+
+
+class FrameReader:
+    """Splits a received byte stream back into (kind, sensor id, payload) frames."""
+
+    def __init__(self):
+        self.buffer = bytearray()
+
+    def feed(self, data):
+        self.buffer += data
+        frames = []
+        position = 0
+        while len(self.buffer) - position >= FRAME_HEADER.size:
+            kind, sensor_id, length = FRAME_HEADER.unpack_from(self.buffer, position)
+            end = position + FRAME_HEADER.size + length
+            if end > len(self.buffer):
+                break
+            frames.append((kind, sensor_id, bytes(self.buffer[position + FRAME_HEADER.size:end])))
+            position = end
+        del self.buffer[:position]
+        return frames
+
+
+def decode_samples(payload):
+    return np.frombuffer(payload, dtype=WIRE_DTYPE)
+
+
+class _Client:
+    """Output queue of one subscriber, the first blob possibly partly sent.
+
+    Each blob holds frames of one kind: a HELLO, a DROPPED notice or a batch of SAMPLES frames;
+    `frames` holds the number of SAMPLES frames in each blob.
+    """
+
+    def __init__(self, sock, address):
+        self.sock = sock
+        self.address = address
+        self.queue = deque()
+        self.frames = deque()
+        self.queued_bytes = 0
+        self.offset = 0  # bytes of queue[0] already sent
+        self.dropped = 0  # SAMPLES frames dropped since the last DROPPED notice
+        self.dropped_total = 0
+        self.writing = False
+
+
+class FanoutServer:
+    """Publishes SensorModule samples to TCP subscribers from one thread.
+
+    batch_interval   : seconds of samples collected into one send per client
+    max_client_bytes : queued output per client before its oldest frames are dropped
+    """
+
+    def __init__(self, host="127.0.0.1", port=8765, batch_interval=0.02, max_client_bytes=256 * 1024):
+        self.batch_interval = batch_interval
+        self.max_client_bytes = max_client_bytes
+        self.clock_offset = time.time() - time.monotonic()
+        self.names = []
+        self.sensors = []
+        self.clients = {}
+        self.pending = []
+        self.pending_lock = threading.Lock()
+        self.names_changed = False
+        self.batches_sent = 0
+        self.frames_dropped = 0
+        self.listener = socket.create_server((host, port))
+        self.listener.setblocking(False)
+        self.address = self.listener.getsockname()
+        self.selector = selectors.DefaultSelector()
+        self.selector.register(self.listener, selectors.EVENT_READ, None)
+        self.running = True
+        self.thread = threading.Thread(target=self.run, name="FanoutServer", daemon=True)
+        self.thread.start()
+
+    def add_sensor(self, sensor, name=None):
+        """Publish everything `sensor` parses from now on. Returns its sensor id."""
+        sensor_id = self.add_name(name or sensor.port)
+        count = sensor.samples.count
+
+        def on_samples(sensor):
+            # Reader thread: only hand the new samples over, the server thread does the rest
+            nonlocal count
+            samples, count = sensor.get_new_samples(count)
+            self.publish(sensor_id, samples)
+
+        sensor.add_listener(on_samples)
+        self.sensors.append((sensor, on_samples))
+        return sensor_id
+
+    def add_name(self, name):
+        """Sensor id for samples passed to publish() directly."""
+        self.names.append(name)
+        self.names_changed = True  # connected clients get a new HELLO with the next batch
+        return len(self.names) - 1
+
+    def publish(self, sensor_id, samples):
+        """Queue a SAMPLE_DTYPE array for the next batch; safe to call from any thread."""
+        if len(samples):
+            with self.pending_lock:
+                self.pending.append((sensor_id, samples))
+
+    def stop(self):
+        self.running = False
+        self.thread.join()
+        for sensor, on_samples in self.sensors:
+            sensor.remove_listener(on_samples)
+
+    def _hello(self):
+        return encode_frame(HELLO, 0, json.dumps({"version": 1, "sensors": self.names}).encode())
+
+    def _accept(self):
+        try:
+            sock, address = self.listener.accept()
+        except BlockingIOError:
+            return
+        sock.setblocking(False)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        client = _Client(sock, address)
+        self.clients[sock] = client
+        self.selector.register(sock, selectors.EVENT_READ, client)
+        self._queue(client, self._hello())
+        self._send(client)
+
+    def _close(self, client):
+        self.selector.unregister(client.sock)
+        del self.clients[client.sock]
+        client.sock.close()
+
+    def _append(self, client, blob, frames):
+        client.queue.append(blob)
+        client.frames.append(frames)
+        client.queued_bytes += len(blob)
+
+    def _queue(self, client, blob, frames=0):
+        """Queue a blob holding `frames` SAMPLES frames (0 for HELLO), dropping the oldest if needed."""
+        if client.queued_bytes + len(blob) > self.max_client_bytes:
+            # Drop oldest first, but keep a partly sent blob or the stream would break
+            index = 1 if client.offset else 0
+            while index < len(client.queue) and client.queued_bytes + len(blob) > self.max_client_bytes:
+                dropped = client.queue[index]
+                kind = dropped[0]
+                if kind == HELLO:
+                    index += 1  # the sensor names are needed to make sense of everything after
+                    continue
+                lost = client.frames[index]
+                del client.queue[index]
+                del client.frames[index]
+                client.queued_bytes -= len(dropped)
+                if kind == DROPPED:
+                    # An undelivered notice: carry its count over to the next one
+                    client.dropped += DROPPED_PAYLOAD.unpack_from(dropped, FRAME_HEADER.size)[0]
+                    continue
+                client.dropped += lost
+                client.dropped_total += lost
+                self.frames_dropped += lost
+                registry.counter("fanout.frames_dropped").add(lost)
+        if client.dropped:
+            self._append(client, encode_frame(DROPPED, 0, DROPPED_PAYLOAD.pack(client.dropped)), 0)
+            client.dropped = 0
+        self._append(client, blob, frames)
+
+    def _send(self, client):
+        queue = client.queue
+        try:
+            while queue:
+                if hasattr(client.sock, "sendmsg"):
+                    # Scatter/gather: send the queued blobs without joining them first
+                    buffers = [memoryview(queue[0])[client.offset:]] + [queue[i] for i in range(1, min(len(queue), 64))]
+                    sent = client.sock.sendmsg(buffers)
+                else:
+                    sent = client.sock.send(memoryview(queue[0])[client.offset:])
+                if sent == 0:
+                    break
+                client.queued_bytes -= sent
+                sent += client.offset
+                while queue and sent >= len(queue[0]):
+                    sent -= len(queue.popleft())
+                    client.frames.popleft()
+                client.offset = sent
+        except BlockingIOError:
+            pass
+        except OSError:
+            self._close(client)
+            return
+        writing = bool(queue)
+        if writing != client.writing:
+            client.writing = writing
+            events = selectors.EVENT_READ | (selectors.EVENT_WRITE if writing else 0)
+            self.selector.modify(client.sock, events, client)
+
+    def _receive(self, client):
+        # Subscribers have nothing to say; reading only notices when they go away
+        try:
+            data = client.sock.recv(4096)
+        except BlockingIOError:
+            return
+        except OSError:
+            data = b""
+        if not data:
+            self._close(client)
+
+    def _flush(self):
+        with self.pending_lock:
+            pending, self.pending = self.pending, []
+        hello = None
+        if self.names_changed:
+            self.names_changed = False
+            hello = self._hello()
+        if not pending and not hello:
+            return
+        batches = {}
+        for sensor_id, samples in pending:
+            batches.setdefault(sensor_id, []).append(samples)
+        blob = b"".join(
+            encode_samples(sensor_id, parts[0] if len(parts) == 1 else np.concatenate(parts), self.clock_offset)
+            for sensor_id, parts in batches.items()
+        )
+        for client in list(self.clients.values()):
+            if hello:
+                self._queue(client, hello)  # its own blob, so it is recognised and never dropped
+            if blob:
+                self._queue(client, blob, len(batches))
+            self._send(client)
+        if blob:
+            self.batches_sent += 1
+
+    def run(self):
+        next_flush = time.monotonic() + self.batch_interval
+        try:
+            while self.running:
+                for key, events in self.selector.select(max(0.0, next_flush - time.monotonic())):
+                    client = key.data
+                    if client is None:
+                        self._accept()
+                    elif client.sock not in self.clients:
+                        continue  # closed earlier in this round
+                    elif events & selectors.EVENT_READ:
+                        self._receive(client)
+                    if client is not None and client.sock in self.clients and events & selectors.EVENT_WRITE:
+                        self._send(client)
+                now = time.monotonic()
+                if now >= next_flush:
+                    self._flush()
+                    next_flush = max(next_flush + self.batch_interval, now)
+        finally:
+            for client in list(self.clients.values()):
+                self._close(client)
+            self.selector.close()
+            self.listener.close()
+
+
+def subscribe(host="127.0.0.1", port=8765):
+    """Connect to a FanoutServer and yield (sensor name, WIRE_DTYPE samples) as they arrive."""
+    names = []
+    reader = FrameReader()
+    with socket.create_connection((host, port)) as sock:
+        while True:
+            data = sock.recv(65536)
+            if not data:
+                return
+            for kind, sensor_id, payload in reader.feed(data):
+                if kind == HELLO:
+                    names = json.loads(payload)["sensors"]
+                elif kind == SAMPLES:
+                    yield names[sensor_id], decode_samples(payload)
+                elif kind == DROPPED:
+                    print(f"Server dropped {DROPPED_PAYLOAD.unpack(payload)[0]} frames (client too slow).")
+
+
+def serve_websocket(port, upstream, host="127.0.0.1"):
+    """Relay the TCP stream at `upstream` (host, port) to WebSocket clients on ws://host:port/."""
+    from gevent import monkey
+    monkey.patch_all()
+    from bottle import Bottle
+    from bottle.ext.websocket import GeventWebSocketServer, websocket
+    from geventwebsocket import WebSocketError
+
+    app = Bottle()
+
+    @app.route("/", apply=[websocket])
+    def relay(ws):
+        # One upstream connection per WebSocket client: a slow browser only backs up its own
+        # TCP connection, and the server's drop-oldest handles it there
+        reader = FrameReader()
+        with socket.create_connection(upstream) as sock:
+            while True:
+                data = sock.recv(65536)
+                if not data:
+                    break
+                frames = reader.feed(data)
+                if not frames:
+                    continue
+                message = b"".join(encode_frame(kind, sensor_id, payload) for kind, sensor_id, payload in frames)
+                try:
+                    ws.send(message, binary=True)
+                except WebSocketError:
+                    break
+
+    app.run(host=host, port=port, server=GeventWebSocketServer, quiet=True)
+
+
+def print_stream(host, port):
+    last = 0.0
+    latest = {}
+    for name, samples in subscribe(host, port):
+        latest[name] = samples[-1]
+        now = time.time()
+        if now - last >= 1.0:
+            last = now
+            print("  ".join(f"{name}: {sample['heading']:6.1f}° ({(now - sample['time']) * 1000:.0f} ms old)"
+                            for name, sample in latest.items()))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--ports", nargs="+", help="serial ports to read and publish")
+    source.add_argument("--simulate", type=int, metavar="N", help="publish N simulated sensors instead")
+    source.add_argument("--connect", metavar="HOST:PORT", help="subscribe and print the stream")
+    parser.add_argument("--baud", type=int, default=9600)
+    parser.add_argument("--rate", type=float, default=100.0, help="lines per second with --simulate")
+    parser.add_argument("--host", default="127.0.0.1", help="address to listen on (0.0.0.0 for the LAN)")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--websocket", type=int, metavar="PORT", help="also serve WebSocket clients on PORT")
+    parser.add_argument("--batch-ms", type=float, default=20.0, help="per-client batching interval")
+    parser.add_argument("--max-client-kb", type=int, default=256, help="queued output per client before dropping")
+    parser.add_argument("--metrics", metavar="FILE", help="append a JSON metrics snapshot to FILE periodically")
+    parser.add_argument("--metrics-interval", type=float, default=5.0, help="seconds between metrics snapshots")
+    args = parser.parse_args()
+
+    if args.connect:
+        host, port = args.connect.rsplit(":", 1)
+        try:
+            print_stream(host, int(port))
+        except KeyboardInterrupt:
+            pass
+        return
+
+    relay = None
+    if args.websocket:
+        # Own process: gevent's monkey patching must not touch the reader threads
+        relay = multiprocessing.Process(target=serve_websocket, args=(args.websocket, (args.host, args.port), args.host),
+                                        daemon=True)
+        relay.start()
+
+    exporter = SnapshotExporter(args.metrics, args.metrics_interval) if args.metrics else None
+    server = FanoutServer(args.host, args.port, batch_interval=args.batch_ms / 1000.0,
+                          max_client_bytes=args.max_client_kb * 1024)
+    simulators = []
+    if args.simulate:
+        from simulator import Simulator
+        sensors = [SensorModule("loop://") for _ in range(args.simulate)]
+        for index, sensor in enumerate(sensors):
+            server.add_sensor(sensor, f"sim{index}")
+            simulator = Simulator(rate=args.rate, rotation=36.0 * (index + 1))
+            simulator.attach(sensor)
+            simulator.start()
+            simulators.append(simulator)
+    else:
+        sensors = [SensorModule(port, args.baud) for port in args.ports]
+        for sensor in sensors:
+            server.add_sensor(sensor)
+    print(f"Publishing {len(sensors)} sensor(s) on {server.address[0]}:{server.address[1]}"
+          + (f", WebSocket on port {args.websocket}" if relay else ""), flush=True)
+
+    try:
+        while True:
+            time.sleep(1.0)
+    except KeyboardInterrupt:
+        pass
+    for simulator in simulators:
+        simulator.stop()
+    server.stop()
+    for sensor in sensors:
+        sensor.stop()
+    if exporter:
+        exporter.stop()
+    print(f"Sent {server.batches_sent} batches, dropped {server.frames_dropped} for slow clients.")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,11 +1,22 @@
+import startup  # first, so startup timing starts as early as possible
+import argparse
+import struct
 import sys
 import os
 from PyQt5.QtWidgets import (
-    QApplication, QWidget, QVBoxLayout, QLabel, QHBoxLayout, QSpacerItem, QSizePolicy, QComboBox
+    QApplication, QWidget, QVBoxLayout, QLabel, QHBoxLayout, QSpacerItem, QSizePolicy, QComboBox, QGridLayout
 )
-from PyQt5.QtGui import QPixmap, QTransform, QPainter
+from PyQt5.QtGui import QPixmap
 from PyQt5.QtCore import Qt, QTimer
 from sensor_module import SensorModule  # Import the sensor module
+from compass_widget import CompassWidget, StatsOverlay
+from sensor_bridge import SensorBridge
+from recording import ReplaySource, session_path
+from calibration import EllipsoidFitter, HeadingPipeline, load_settings
+from port_watcher import PortWatcher
+from metrics import SnapshotExporter
+
+startup.mark("imports")
 
 def resource_path(relative_path):
     """ Get the absolute path to a resource, works for dev and for PyInstaller."""
@@ -17,22 +28,84 @@ def resource_path(relative_path):
     return os.path.join(base_path, relative_path)
 
 
-class CompassApp(QWidget):
-    def __init__(self):
+class CompassWindow:
+    """Shared by CompassApp and CompassGrid: startup report on the first frame, F3 stats overlay."""
+
+    startup_report = None
+    stats_overlay = None
+    stats_position = (5, 50)
+
+    def on_first_frame(self):
+        startup.mark("first_frame")
+        startup.report(self.startup_report)
+
+    def toggle_stats(self):
+        """Show or hide the live metrics overlay (also bound to F3)."""
+        if self.stats_overlay is None:
+            self.stats_overlay = StatsOverlay(parent=self)
+            self.stats_overlay.move(*self.stats_position)
+            self.stats_overlay.show()
+            self.stats_overlay.raise_()
+        else:
+            self.stats_overlay.timer.stop()
+            self.stats_overlay.deleteLater()
+            self.stats_overlay = None
+
+    def keyPressEvent(self, event):
+        if event.key() == Qt.Key_F3:
+            self.toggle_stats()
+        else:
+            super().keyPressEvent(event)
+
+
+class CompassApp(CompassWindow, QWidget):
+    def __init__(self, mode="push", max_fps=60, record_path=None, make_pipeline=None, startup_report=None,
+                 show_stats=False):
         super().__init__()
+        self.mode = mode
+        self.max_fps = max_fps
+        self.record_path = record_path
+        self.startup_report = startup_report
+        # Returns a fresh calibration.HeadingPipeline per sensor, or None for raw headings
+        self.make_pipeline = make_pipeline or (lambda: None)
         self.initUI()
+        self.compass_display.first_frame.connect(self.on_first_frame)
 
         self.sensor = None
+        self.bridge = None
+        if show_stats:
+            self.toggle_stats()
 
+        # Port list is filled in (and kept current) from a background thread
+        self.port_watcher = PortWatcher(parent=self)
+        self.port_watcher.ports_changed.connect(self.populate_com_ports)
+        self.port_watcher.start()
+
+        # Fallback: poll the sensor on a fixed timer instead of waiting for its updates
         self.timer = QTimer(self)
         self.timer.timeout.connect(self.update_direction_from_sensor)
-        self.timer.start(100)
+        if mode == "poll":
+            self.timer.start(100)
 
     def initUI(self):
         self.setWindowTitle('Compass App')
         self.setGeometry(100, 100, 400, 400)
         self.setStyleSheet("background-color: black;")
 
+        # Load images
+        self.compass_circle = QPixmap(resource_path(os.path.join("images", "compass_circle.png")))
+        self.compass_needle = QPixmap(resource_path(os.path.join("images", "compass_needle.png")))
+
+        if self.compass_circle.isNull() or self.compass_needle.isNull():
+            print("Error: Failed to load compass images.")
+            sys.exit(1)
+
+        # Resize images
+        new_size1 = self.compass_circle.size()
+        new_size2 = self.compass_needle.size()*0.8
+        self.compass_circle = self.compass_circle.scaled(new_size1, Qt.KeepAspectRatio, Qt.SmoothTransformation)
+        self.compass_needle = self.compass_needle.scaled(new_size2, Qt.KeepAspectRatio, Qt.SmoothTransformation)
+
         main_layout = QVBoxLayout()
 
         # COM port dropdown
@@ -41,7 +114,6 @@ class CompassApp(QWidget):
         self.com_port_combo.setStyleSheet("font-size: 30px;")
         self.com_port_combo.setFixedSize(200, 40)
         self.com_port_combo.addItem("COM Port")
-        self.populate_com_ports()
         self.com_port_combo.currentIndexChanged.connect(self.connect_to_com_port)
         com_layout.addWidget(self.com_port_combo)
         com_layout.setAlignment(Qt.AlignLeft | Qt.AlignTop)
@@ -56,8 +128,7 @@ class CompassApp(QWidget):
         spacer_left = QSpacerItem(40, 20, QSizePolicy.Expanding, QSizePolicy.Minimum)
         h_layout.addItem(spacer_left)
 
-        self.compass_display = QLabel(self)
-        self.compass_display.setAlignment(Qt.AlignCenter)
+        self.compass_display = CompassWidget(self.compass_circle, self.compass_needle, parent=self)
         h_layout.addWidget(self.compass_display)
 
         spacer_right = QSpacerItem(40, 20, QSizePolicy.Expanding, QSizePolicy.Minimum)
@@ -76,45 +147,22 @@ class CompassApp(QWidget):
 
         self.setLayout(main_layout)
 
-        # Load images
-        self.compass_circle = QPixmap(resource_path(os.path.join("images", "compass_circle.png")))
-        self.compass_needle = QPixmap(resource_path(os.path.join("images", "compass_needle.png")))
-
-        if self.compass_circle.isNull() or self.compass_needle.isNull():
-            print("Error: Failed to load compass images.")
-            sys.exit(1)
-
-        # Resize images
-        new_size1 = self.compass_circle.size()
-        new_size2 = self.compass_needle.size()*0.8
-        self.compass_circle = self.compass_circle.scaled(new_size1, Qt.KeepAspectRatio, Qt.SmoothTransformation)
-        self.compass_needle = self.compass_needle.scaled(new_size2, Qt.KeepAspectRatio, Qt.SmoothTransformation)
-
-        self.compass_display.setFixedSize(self.compass_circle.size())
-
-        # Combine images into one base image
-        self.combined_compass = QPixmap(self.compass_circle.size())
-        self.combined_compass.fill(Qt.transparent)
-
-        painter = QPainter(self.combined_compass)
-        painter.setRenderHint(QPainter.Antialiasing)
-        painter.drawPixmap(0, 0, self.compass_circle)
-
-        circle_center = self.compass_circle.rect().center()
-        needle_offset = self.compass_needle.rect().center()
-        needle_x = circle_center.x() - needle_offset.x()
-        needle_y = circle_center.y() - needle_offset.y()
-        painter.drawPixmap(needle_x, needle_y, self.compass_needle)
-        painter.end()
-
         self.direction = 0
         self.update_compass_display()
 
-    def populate_com_ports(self):
-        import serial.tools.list_ports
-        ports = serial.tools.list_ports.comports()
+    def populate_com_ports(self, ports):
+        startup.mark("ports_listed")
+        current = self.com_port_combo.currentText()
+        # Keep the selected port listed even while it is unplugged; the sensor keeps retrying it
+        if current != "COM Port" and current not in ports:
+            ports = ports + [current]
+        self.com_port_combo.blockSignals(True)
+        self.com_port_combo.clear()
+        self.com_port_combo.addItem("COM Port")
         for port in ports:
-            self.com_port_combo.addItem(port.device)
+            self.com_port_combo.addItem(port)
+        self.com_port_combo.setCurrentText(current)
+        self.com_port_combo.blockSignals(False)
 
     def connect_to_com_port(self):
         selected_port = self.com_port_combo.currentText()
@@ -122,43 +170,195 @@ class CompassApp(QWidget):
             print("Please select a valid COM port.")
             return
         try:
-            if self.sensor:
-                self.sensor.stop()
-            self.sensor = SensorModule(port=selected_port)
-            print(f"Connected to {selected_port}")
+            # Opening happens on the sensor loop; state changes arrive through show_state
+            self.attach_sensor(SensorModule(port=selected_port, pipeline=self.make_pipeline()))
+            if self.record_path:
+                # One file per connection, so switching ports never overwrites a capture
+                self.sensor.start_recording(session_path(self.record_path, selected_port))
+            self.show_state(self.sensor, "connecting")
         except Exception as e:
             print(f"Failed to connect to {selected_port}: {e}")
 
+    def open_replay(self, path, speed=1.0, start=0.0):
+        """Show a recording (see recording.py) instead of a live port."""
+        try:
+            sensor = SensorModule(source=ReplaySource(path, speed=speed, start=start), pipeline=self.make_pipeline())
+        except (OSError, ValueError, struct.error) as e:
+            print(f"Failed to open recording {path}: {e}")
+            self.degree_label.setText(f"Cannot replay {os.path.basename(path)}")
+            return
+        self.attach_sensor(sensor)
+        self.com_port_combo.setEnabled(False)
+
+    def attach_sensor(self, sensor):
+        if self.bridge:
+            self.bridge.close()
+            self.bridge = None
+        if self.sensor:
+            self.sensor.stop(timeout=0)
+        self.sensor = sensor
+        self.bridge = SensorBridge(self.sensor, max_fps=self.max_fps, samples=self.mode == "push", parent=self)
+        self.bridge.heading_changed.connect(self.set_direction)
+        self.bridge.state_changed.connect(self.show_state)
+
+    def show_state(self, sensor, state):
+        # A replaced sensor's bridge can still have queued state changes
+        if sensor is not self.sensor:
+            return
+        port = sensor.port
+        if state == "connecting":
+            self.degree_label.setText(f"Connecting to {port}...")
+        elif state == "connected":
+            self.degree_label.setText(f"Connected to {port}")
+        elif state == "retrying":
+            delay = sensor.retry_delay
+            retry = f", retrying in {delay:g} s" if delay is not None else ", retrying"
+            self.degree_label.setText(f"{port} unavailable{retry}")
+
+    def closeEvent(self, event):
+        self.port_watcher.stop()
+        if self.sensor:
+            self.sensor.stop(timeout=0)
+        super().closeEvent(event)
+
     def update_direction_from_sensor(self):
         if self.sensor:
-            new_direction = self.sensor.get_degree()
-            self.direction = new_direction
-            self.degree_label.setText(f"Direction: {self.direction:.2f}°")
-            self.update_compass_display()
+            new_direction, timestamp = self.sensor.get_latest()
+            self.set_direction(new_direction, timestamp)
+
+    def set_direction(self, direction, timestamp=None):
+        self.direction = direction
+        self.degree_label.setText(f"Direction: {self.direction:.2f}°")
+        self.update_compass_display(timestamp)
 
-    def update_compass_display(self):
-        rotated_pixmap = QPixmap(self.combined_compass.size())
-        rotated_pixmap.fill(Qt.transparent)
+    def update_compass_display(self, timestamp=None):
+        # Repaints only when the heading crosses a display step; frames come from the widget's rotation cache.
+        # Paint time and sample age at paint are recorded by the widget (ui.paint_ms, ui.sample_age_ms).
+        self.compass_display.set_heading(self.direction, timestamp)
 
-        painter = QPainter(rotated_pixmap)
-        painter.setRenderHint(QPainter.Antialiasing)
 
-        center = self.combined_compass.rect().center()
+class CompassGrid(CompassWindow, QWidget):
+    """One small compass per port, all read by the shared SensorLoop."""
 
-        transform = QTransform()
-        transform.translate(center.x(), center.y())
-        transform.rotate(-self.direction)
-        transform.translate(-center.x(), -center.y())
+    stats_position = (5, 5)
 
-        painter.setTransform(transform)
-        painter.drawPixmap(0, 0, self.combined_compass)
-        painter.end()
+    def __init__(self, ports, cell_size=160, max_fps=30, make_pipeline=None, record_path=None,
+                 startup_report=None, show_stats=False):
+        super().__init__()
+        self.startup_report = startup_report
+        self.setWindowTitle('Compass Grid')
+        self.setStyleSheet("background-color: black;")
 
-        self.compass_display.setPixmap(rotated_pixmap)
+        circle = QPixmap(resource_path(os.path.join("images", "compass_circle.png")))
+        needle = QPixmap(resource_path(os.path.join("images", "compass_needle.png")))
+        if circle.isNull() or needle.isNull():
+            print("Error: Failed to load compass images.")
+            sys.exit(1)
+        scale = cell_size / max(circle.width(), circle.height())
+        circle = circle.scaled(circle.size() * scale, Qt.KeepAspectRatio, Qt.SmoothTransformation)
+        needle = needle.scaled(needle.size() * scale * 0.8, Qt.KeepAspectRatio, Qt.SmoothTransformation)
+
+        layout = QGridLayout()
+        columns = max(1, int(len(ports) ** 0.5 + 0.999))
+        self.sensors = []
+        self.bridges = []
+        cache = None
+        for index, port in enumerate(ports):
+            # All cells rotate the same image, so they share one frame cache
+            display = CompassWidget(circle, needle, cache=cache, parent=self)
+            cache = display.cache
+            label = QLabel(port, self)
+            label.setAlignment(Qt.AlignCenter)
+            label.setStyleSheet("font-size: 14px; color: white;")
+
+            cell = QVBoxLayout()
+            cell.addWidget(display, alignment=Qt.AlignCenter)
+            cell.addWidget(label)
+            layout.addLayout(cell, index // columns, index % columns)
+
+            sensor = SensorModule(port=port, pipeline=make_pipeline() if make_pipeline else None)
+            if record_path:
+                sensor.start_recording(session_path(record_path, port))
+            bridge = SensorBridge(sensor, max_fps=max_fps, parent=self)
+            bridge.heading_changed.connect(
+                lambda heading, timestamp, display=display, label=label, port=port: (
+                    display.set_heading(heading, timestamp),
+                    label.setText(f"{port}: {heading:.1f}°"),
+                )
+            )
+            self.sensors.append(sensor)
+            self.bridges.append(bridge)
+            if index == 0:
+                display.first_frame.connect(self.on_first_frame)
+        self.setLayout(layout)
+        if show_stats:
+            self.toggle_stats()
+
+    def closeEvent(self, event):
+        for bridge in self.bridges:
+            bridge.close()
+        for sensor in self.sensors:
+            sensor.stop(timeout=0)
+        super().closeEvent(event)
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description="Compass App")
+    parser.add_argument("--poll", action="store_true", help="poll the sensor every 100 ms instead of push updates")
+    parser.add_argument("--max-fps", type=int, default=60, help="upper limit for push updates per second, 0 = no limit")
+    parser.add_argument("--ports", nargs="+", help="show a grid with one compass per port")
+    parser.add_argument("--record", metavar="FILE",
+                        help="record each connected port to FILE-<port>-<time> (FILE.rec -> FILE-COM3-...rec)")
+    parser.add_argument("--replay", metavar="FILE", help="show a recording instead of a port")
+    parser.add_argument("--speed", type=float, default=1.0, help="replay speed, 0 = as fast as possible")
+    parser.add_argument("--start", type=float, default=0.0, help="replay from this many seconds in")
+    parser.add_argument("--calibration", metavar="FILE",
+                        help="JSON with matrix/offset (hard/soft iron), pitch/roll and window (smoothing)")
+    parser.add_argument("--auto-calibrate", action="store_true", help="fit hard/soft iron while running")
+    parser.add_argument("--smooth", type=int, default=None, help="circular moving average over N samples")
+    parser.add_argument("--startup-report", metavar="FILE", help="append startup timings to FILE as JSON")
+    parser.add_argument("--stats", action="store_true", help="show the live metrics overlay (toggle with F3)")
+    parser.add_argument("--metrics", metavar="FILE", help="append a JSON metrics snapshot to FILE periodically")
+    parser.add_argument("--metrics-interval", type=float, default=5.0, help="seconds between metrics snapshots")
+    args, _ = parser.parse_known_args(argv[1:])
+    if args.max_fps < 0:
+        parser.error("--max-fps must be 0 or more")
+    if args.ports and (args.poll or args.replay):
+        parser.error("--poll and --replay cannot be used with --ports")
+    return args
+
+
+def pipeline_factory(args):
+    """Build the per-sensor HeadingPipeline factory from the command line, or None for raw headings."""
+    if not (args.calibration or args.auto_calibrate or args.smooth):
+        return None
+    settings = load_settings(args.calibration) if args.calibration else {}
+    if args.smooth:
+        settings["window"] = args.smooth
+
+    def make_pipeline():
+        fitter = EllipsoidFitter() if args.auto_calibrate else None
+        return HeadingPipeline.from_settings(settings, fitter=fitter)
+    return make_pipeline
 
 
 if __name__ == '__main__':
+    args = parse_args(sys.argv)
     app = QApplication(sys.argv)
-    compass_app = CompassApp()
+    exporter = SnapshotExporter(args.metrics, args.metrics_interval) if args.metrics else None
+    if args.ports:
+        compass_app = CompassGrid(args.ports, max_fps=args.max_fps, make_pipeline=pipeline_factory(args),
+                                  record_path=args.record, startup_report=args.startup_report,
+                                  show_stats=args.stats)
+    else:
+        compass_app = CompassApp(mode="poll" if args.poll else "push", max_fps=args.max_fps,
+                                 record_path=args.record, make_pipeline=pipeline_factory(args),
+                                 startup_report=args.startup_report, show_stats=args.stats)
+        if args.replay:
+            compass_app.open_replay(args.replay, args.speed, args.start)
     compass_app.show()
-    sys.exit(app.exec_())
+    startup.mark("window_shown")
+    status = app.exec_()
+    if exporter:
+        exporter.stop()
+    sys.exit(status)
@@ -0,0 +1,173 @@
+"""Low-overhead pipeline metrics: counters, fixed-bucket histograms and rate-limited logging.
+
+Recording a value is an integer add (Counter) or a bisect into a fixed bucket list (Histogram)
+under an uncontended per-metric lock, so instrumentation can stay on in the reader thread. The
+same metric is written from several threads (the loop thread, replay threads, every
+get_degree() caller, the connect workers), so updates are locked; they happen once per batch
+or call, not per byte.
+
+`registry` is the process-wide Metrics instance the other modules report to. Its snapshots
+are what the CompassApp stats overlay shows and what SnapshotExporter writes as JSON lines.
+"""
+import json
+import threading
+import time
+from bisect import bisect_left
+
+# Upper bucket bounds, the last bucket catches everything above
+MICROSECOND_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000, 50000)
+MILLISECOND_BUCKETS = (0.1, 0.2, 0.5, 1, 2, 5, 10, 16, 20, 33, 50, 100, 200, 500, 1000, 5000)
+
+
+class Counter:
+    def __init__(self):
+        self.value = 0
+        self.lock = threading.Lock()
+
+    def add(self, amount=1):
+        with self.lock:
+            self.value += amount
+
+
+class Histogram:
+    """Counts of values per fixed bucket; percentiles are the upper bound of the bucket they fall in."""
+
+    def __init__(self, bounds):
+        self.bounds = tuple(bounds)
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.lock = threading.Lock()
+
+    def add(self, value):
+        index = bisect_left(self.bounds, value)
+        with self.lock:
+            self.counts[index] += 1
+            self.count += 1
+            self.total += value
+            if value > self.max:
+                self.max = value
+
+    def percentile(self, fraction):
+        if not self.count:
+            return None
+        rank = fraction * self.count
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank and count:
+                return self.bounds[index] if index < len(self.bounds) else self.max
+        return self.max
+
+    def summary(self):
+        with self.lock:
+            return self._summary()
+
+    def _summary(self):
+        if not self.count:
+            return {"count": 0}
+        return {
+            "count": self.count,
+            "mean": self.total / self.count,
+            "p50": self.percentile(0.5),
+            "p95": self.percentile(0.95),
+            "p99": self.percentile(0.99),
+            "max": self.max,
+            "buckets": dict(zip([str(bound) for bound in self.bounds] + ["inf"], self.counts)),
+        }
+
+
+class Metrics:
+    """Named counters and histograms, created on first use."""
+
+    def __init__(self):
+        self.counters = {}
+        self.histograms = {}
+        self.lock = threading.Lock()  # only taken to create metrics and to snapshot
+
+    def counter(self, name):
+        counter = self.counters.get(name)
+        if counter is None:
+            with self.lock:
+                counter = self.counters.setdefault(name, Counter())
+        return counter
+
+    def histogram(self, name, bounds=MILLISECOND_BUCKETS):
+        histogram = self.histograms.get(name)
+        if histogram is None:
+            with self.lock:
+                histogram = self.histograms.setdefault(name, Histogram(bounds))
+        return histogram
+
+    def snapshot(self, previous=None):
+        """Counters, histogram summaries and, given an earlier snapshot, counter rates per second."""
+        with self.lock:
+            now = time.monotonic()
+            values = {name: counter.value for name, counter in self.counters.items()}
+            histograms = {name: histogram.summary() for name, histogram in self.histograms.items()}
+        snapshot = {"time": time.time(), "monotonic": now, "counters": values, "histograms": histograms}
+        if previous is not None:
+            elapsed = now - previous["monotonic"]
+            before = previous["counters"]
+            snapshot["rates"] = {name: (value - before.get(name, 0)) / elapsed if elapsed > 0 else 0.0
+                                 for name, value in values.items()}
+        return snapshot
+
+
+registry = Metrics()
+
+
+class SnapshotExporter:
+    """Appends a snapshot (with rates over the interval) to `path` as a JSON line every `interval` seconds."""
+
+    def __init__(self, path, interval=5.0, metrics=None):
+        self.path = path
+        self.interval = interval
+        self.metrics = metrics or registry
+        self.previous = self.metrics.snapshot()
+        self.stop_event = threading.Event()
+        self.thread = threading.Thread(target=self.run, name="SnapshotExporter", daemon=True)
+        self.thread.start()
+
+    def write(self):
+        snapshot = self.metrics.snapshot(self.previous)
+        self.previous = snapshot
+        with open(self.path, "a") as f:
+            f.write(json.dumps(snapshot) + "\n")
+
+    def run(self):
+        while not self.stop_event.wait(self.interval):
+            self.write()
+
+    def stop(self):
+        self.stop_event.set()
+        self.thread.join()
+        self.write()
+
+
+class RateLimitedLog:
+    """print() at most once per `interval` seconds per key; repeats in between are only counted."""
+
+    def __init__(self, interval=5.0, metrics=None):
+        self.interval = interval
+        self.metrics = metrics or registry
+        self.next_time = {}
+        self.suppressed = {}
+        self.lock = threading.Lock()
+
+    def __call__(self, key, message):
+        self.metrics.counter(f"log.{key}").add()
+        now = time.monotonic()
+        with self.lock:
+            if now < self.next_time.get(key, 0.0):
+                self.suppressed[key] = self.suppressed.get(key, 0) + 1
+                return
+            self.next_time[key] = now + self.interval
+            suppressed = self.suppressed.pop(key, 0)
+        if suppressed:
+            message += f" ({suppressed} similar messages suppressed)"
+        print(message)
+
+
+log = RateLimitedLog()
@@ -0,0 +1,40 @@
+import threading
+from PyQt5.QtCore import QObject, pyqtSignal
+from metrics import log
+
+
+class PortWatcher(QObject):
+    """Lists serial ports on a background thread and reports changes (hot-plug).
+
+    pyserial has no plug/unplug notification, so comports() is polled every `interval` seconds,
+    off the GUI thread because enumeration can take seconds with many USB adapters.
+    """
+
+    ports_changed = pyqtSignal(list)  # sorted device names
+
+    def __init__(self, interval=2.0, parent=None):
+        super().__init__(parent)
+        self.interval = interval
+        self.ports = None
+        self.stop_event = threading.Event()
+        self.thread = threading.Thread(target=self.run, name="PortWatcher", daemon=True)
+
+    def start(self):
+        self.thread.start()
+
+    def run(self):
+        # Imported here so the import cost is not paid before the window shows
+        import serial.tools.list_ports
+        while not self.stop_event.is_set():
+            try:
+                ports = sorted(port.device for port in serial.tools.list_ports.comports())
+            except OSError as e:
+                log("list_ports", f"Failed to list serial ports: {e}")
+                ports = self.ports or []
+            if ports != self.ports:
+                self.ports = ports
+                self.ports_changed.emit(ports)
+            self.stop_event.wait(self.interval)
+
+    def stop(self):
+        self.stop_event.set()
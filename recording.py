@@ -0,0 +1,329 @@
+"""Binary recordings of SensorModule input and replay at real time, N x or full speed.
+
+File layout (little endian):
+  header  : b"CMPSREC1", f64 wall-clock start (time.time()), f64 monotonic start
+  records : f64 timestamp, u8 kind, 3 pad bytes, u32 payload length, u32 crc32(payload), payload
+            kind 1 = raw bytes as read from the port
+            kind 2 = parsed samples, n x (x, y, z, heading) as float32
+A sidecar "<file>.idx" holds (f64 timestamp, u64 offset) pairs about once per second so that
+seeking in long captures does not scan the data. A torn last record (crash, power loss) is
+detected by its length/CRC and ignored.
+
+Usage: python recording.py FILE   prints a summary of a recording
+"""
+import atexit
+import mmap
+import os
+import re
+import struct
+import sys
+import threading
+import time
+import zlib
+from collections import deque
+import numpy as np
+from sensor_module import SAMPLE_DTYPE
+from metrics import registry
+
+MAGIC = b"CMPSREC1"
+FILE_HEADER = struct.Struct("<8sdd")
+RECORD_HEADER = struct.Struct("<dBxxxII")
+INDEX_DTYPE = np.dtype([("timestamp", "<f8"), ("offset", "<u8")])
+
+RAW = 1
+SAMPLES = 2
+
+_running_recorders = set()  # closed and flushed at exit if nobody else did
+
+
+def index_path(path):
+    return path + ".idx"
+
+
+def session_path(base, port):
+    """New file name for one connection: "capture.rec" -> "capture-COM3-20240101-120000.rec"."""
+    root, ext = os.path.splitext(base)
+    name = re.sub(r"[^\w.-]+", "_", port or "").strip("_") or "sensor"
+    stem = f"{root}-{name}-{time.strftime('%Y%m%d-%H%M%S')}"
+    path = stem + (ext or ".rec")
+    number = 1
+    while os.path.exists(path):
+        path = f"{stem}-{number}{ext or '.rec'}"
+        number += 1
+    return path
+
+
+class Recorder:
+    """Append-only writer. Callers only queue records; a background thread does the file I/O.
+
+    If the disk cannot keep up and more than `max_pending_bytes` are queued, new records are
+    dropped (and counted in `dropped`) instead of blocking the reader. An existing file is never
+    overwritten (FileExistsError); see session_path() for a fresh name per connection.
+    close(wait=False) returns at once; the writer thread writes what is queued and closes the file.
+    """
+
+    def __init__(self, path, index_interval=1.0, max_pending_bytes=16 * 1024 * 1024):
+        self.path = path
+        self.index_interval = index_interval
+        self.max_pending_bytes = max_pending_bytes
+        self.file = open(path, "xb")
+        self.index_file = open(index_path(path), "wb")
+        self.file.write(FILE_HEADER.pack(MAGIC, time.time(), time.monotonic()))
+        self.offset = FILE_HEADER.size
+        self.next_index_time = None
+        self.queue = deque()
+        self.lock = threading.Lock()
+        self.pending_bytes = 0
+        self.dropped = 0
+        self.written = 0
+        self.wakeup = threading.Event()
+        self.running = True
+        self.thread = threading.Thread(target=self.run, name="Recorder", daemon=True)
+        _running_recorders.add(self)
+        self.thread.start()
+
+    def write_raw(self, timestamp, data):
+        self._put(RAW, timestamp, bytes(data))
+
+    def write_samples(self, timestamp, samples):
+        values = np.empty((len(samples), 4), dtype="<f4")
+        values[:, 0] = samples["x"]
+        values[:, 1] = samples["y"]
+        values[:, 2] = samples["z"]
+        values[:, 3] = samples["heading"]
+        self._put(SAMPLES, timestamp, values.tobytes())
+
+    def _put(self, kind, timestamp, payload):
+        with self.lock:
+            if self.pending_bytes + len(payload) > self.max_pending_bytes:
+                self.dropped += 1
+                registry.counter("recorder.dropped").add()
+                return
+            self.pending_bytes += len(payload)
+            self.queue.append((kind, timestamp, payload))
+        self.wakeup.set()
+
+    def _flush(self):
+        parts = []
+        index = []
+        with self.lock:
+            queued, self.queue = self.queue, deque()
+            self.pending_bytes = 0
+        for kind, timestamp, payload in queued:
+            if self.next_index_time is None or timestamp >= self.next_index_time:
+                index.append((timestamp, self.offset))
+                self.next_index_time = timestamp + self.index_interval
+            parts.append(RECORD_HEADER.pack(timestamp, kind, len(payload), zlib.crc32(payload)))
+            parts.append(payload)
+            self.offset += RECORD_HEADER.size + len(payload)
+            self.written += 1
+        if parts:
+            self.file.write(b"".join(parts))
+            self.file.flush()
+        if index:
+            # The index only points at data that is already in the file
+            self.index_file.write(np.array(index, dtype=INDEX_DTYPE).tobytes())
+            self.index_file.flush()
+
+    def run(self):
+        while self.running:
+            self.wakeup.wait(0.5)
+            self.wakeup.clear()
+            self._flush()
+        self._flush()
+        self.file.close()
+        self.index_file.close()
+        _running_recorders.discard(self)
+
+    def close(self, wait=True):
+        self.running = False
+        self.wakeup.set()
+        if wait:
+            self.thread.join()
+
+
+@atexit.register
+def _close_running_recorders():
+    # Daemon writer threads are killed at exit; finish what is queued first
+    for recorder in list(_running_recorders):
+        recorder.close()
+
+
+class Recording:
+    """Read-only, memory-mapped view of a recording."""
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, "rb") as f:
+            self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.wall_start, self.monotonic_start = FILE_HEADER.unpack_from(self.map, 0)
+        if magic != MAGIC:
+            self.map.close()
+            raise ValueError(f"{path} is not a compass recording")
+        if os.path.exists(index_path(path)):
+            self.index = np.fromfile(index_path(path), dtype=INDEX_DTYPE)
+        else:
+            self.index = self.build_index()
+
+    def close(self):
+        self.map.close()
+
+    def records(self, offset=FILE_HEADER.size):
+        """Yield (kind, timestamp, payload bytes) from `offset` up to the last complete record."""
+        size = len(self.map)
+        while offset + RECORD_HEADER.size <= size:
+            timestamp, kind, length, crc = RECORD_HEADER.unpack_from(self.map, offset)
+            start = offset + RECORD_HEADER.size
+            if start + length > size:
+                return
+            payload = self.map[start:start + length]
+            if zlib.crc32(payload) != crc:
+                return
+            yield kind, timestamp, payload
+            offset = start + length
+
+    def build_index(self, interval=1.0):
+        """Scan the whole file for a missing .idx sidecar."""
+        entries = []
+        next_time = None
+        offset = FILE_HEADER.size
+        for kind, timestamp, payload in self.records():
+            if next_time is None or timestamp >= next_time:
+                entries.append((timestamp, offset))
+                next_time = timestamp + interval
+            offset += RECORD_HEADER.size + len(payload)
+        return np.array(entries, dtype=INDEX_DTYPE)
+
+    @property
+    def start_time(self):
+        return float(self.index["timestamp"][0]) if len(self.index) else self.monotonic_start
+
+    def end_time(self):
+        """Timestamp of the last complete record; only scans from the last index entry."""
+        if not len(self.index):
+            return self.start_time
+        end = float(self.index["timestamp"][-1])
+        for _, timestamp, _ in self.records(int(self.index["offset"][-1])):
+            end = timestamp
+        return end
+
+    def seek(self, timestamp):
+        """Offset of the first record at or after `timestamp`."""
+        if not len(self.index):
+            return FILE_HEADER.size
+        i = max(0, int(np.searchsorted(self.index["timestamp"], timestamp, side="right")) - 1)
+        offset = int(self.index["offset"][i])
+        for _, record_time, payload in self.records(offset):
+            if record_time >= timestamp:
+                break
+            offset += RECORD_HEADER.size + len(payload)
+        return offset
+
+    def samples(self, start=None, end=None):
+        """Parsed samples recorded between the `start` and `end` timestamps as a SAMPLE_DTYPE array."""
+        offset = self.seek(start) if start is not None else FILE_HEADER.size
+        chunks = []
+        for kind, timestamp, payload in self.records(offset):
+            if end is not None and timestamp > end:
+                break
+            if kind != SAMPLES:
+                continue
+            values = np.frombuffer(payload, dtype="<f4").reshape(-1, 4)
+            chunk = np.empty(len(values), dtype=SAMPLE_DTYPE)
+            chunk["timestamp"] = timestamp
+            chunk["x"] = values[:, 0]
+            chunk["y"] = values[:, 1]
+            chunk["z"] = values[:, 2]
+            chunk["heading"] = values[:, 3]
+            chunks.append(chunk)
+        if not chunks:
+            return np.empty(0, dtype=SAMPLE_DTYPE)
+        return np.concatenate(chunks)
+
+
+class ReplaySource:
+    """Feeds the raw bytes of a recording into a SensorModule.
+
+    speed is a multiple of real time; 0 replays as fast as possible. start skips that many
+    seconds into the recording (through the index). With repeat=True the recording loops.
+    The file is opened in attach(), so a missing or invalid file raises to whoever creates the
+    SensorModule instead of ending the replay thread quietly.
+    """
+
+    def __init__(self, path, speed=1.0, start=0.0, repeat=False):
+        self.path = path
+        self.speed = speed
+        self.start = start
+        self.repeat = repeat
+        self.sensor = None
+        self.running = False
+        self.finished = threading.Event()
+        self.stop_event = threading.Event()
+        self.thread = None
+        self.recording = None
+
+    def attach(self, sensor):
+        self.recording = Recording(self.path)
+        self.sensor = sensor
+        self.running = True
+        self.thread = threading.Thread(target=self.run, name="ReplaySource", daemon=True)
+        self.thread.start()
+
+    def run(self):
+        recording = self.recording
+        try:
+            begin = recording.seek(recording.start_time + self.start)
+            while self.running:
+                self._play(recording, begin)
+                if not self.repeat:
+                    break
+        except (OSError, ValueError, struct.error) as e:
+            print(f"Replay of {self.path} stopped: {e}")
+        finally:
+            recording.close()
+            self.running = False
+            self.finished.set()
+
+    def _play(self, recording, offset):
+        first = None
+        wall_start = time.monotonic()
+        for kind, timestamp, payload in recording.records(offset):
+            if not self.running:
+                return
+            if kind != RAW:
+                continue
+            if first is None:
+                first = timestamp
+            if self.speed > 0:
+                delay = wall_start + (timestamp - first) / self.speed - time.monotonic()
+                if delay > 0 and self.stop_event.wait(delay):
+                    return
+            self.sensor.feed(payload)
+
+    def stop(self):
+        self.running = False
+        self.stop_event.set()
+        if self.thread is not None and self.thread is not threading.current_thread():
+            self.thread.join()
+
+
+def main():
+    if len(sys.argv) != 2:
+        print(__doc__.strip().splitlines()[-1])
+        sys.exit(1)
+    recording = Recording(sys.argv[1])
+    samples = recording.samples()
+    kinds = {RAW: 0, SAMPLES: 0}
+    for kind, _, _ in recording.records():
+        kinds[kind] = kinds.get(kind, 0) + 1
+    print(f"File:        {sys.argv[1]}")
+    print(f"Started:     {time.ctime(recording.wall_start)}")
+    print(f"Duration:    {recording.end_time() - recording.start_time:.3f} s")
+    print(f"Raw chunks:  {kinds[RAW]}")
+    print(f"Samples:     {len(samples)} in {kinds[SAMPLES]} batches")
+    print(f"Index:       {len(recording.index)} entries")
+    recording.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+import time
+from PyQt5.QtCore import QObject, QTimer, pyqtSignal
+from metrics import registry
+
+COALESCED = registry.counter("ui.coalesced_updates")
+
+
+class SensorBridge(QObject):
+    """Delivers SensorModule updates to the GUI thread.
+
+    The reader thread only emits `_wake` (a queued signal) when no delivery is already pending,
+    so bursts collapse into a single GUI-side event. The GUI side then emits `heading_changed`
+    at most `max_fps` times per second (0: no cap, once per wake-up). Nothing runs while no
+    data is arriving.
+    Connection state changes are forwarded as `state_changed` together with the sensor they
+    belong to; with samples=False only those are.
+    """
+
+    heading_changed = pyqtSignal(float, float)  # heading, arrival timestamp (time.monotonic())
+    state_changed = pyqtSignal(object, str)  # sensor, state
+    _wake = pyqtSignal()
+
+    def __init__(self, sensor, max_fps=60, samples=True, parent=None):
+        super().__init__(parent)
+        self.sensor = sensor
+        self.interval = 1.0 / max_fps if max_fps > 0 else 0.0
+        self.last_delivery = 0.0
+        self.pending = False
+        self.coalesced = 0
+
+        self.frame_timer = QTimer(self)
+        self.frame_timer.setSingleShot(True)
+        self.frame_timer.timeout.connect(self.deliver)
+        self._wake.connect(self.on_wake)
+        if samples:
+            sensor.add_listener(self.on_samples)
+        sensor.add_state_listener(self.on_state)
+
+    def on_state(self, sensor, state):
+        # Loop thread; the signal is queued to the GUI thread
+        self.state_changed.emit(sensor, state)
+
+    def on_samples(self, sensor):
+        # Reader thread: keep this cheap, the GUI reads the latest value itself
+        if self.pending:
+            self.coalesced += 1
+            COALESCED.add()
+            return
+        self.pending = True
+        self._wake.emit()
+
+    def on_wake(self):
+        if self.frame_timer.isActive():
+            return
+        wait = self.last_delivery + self.interval - time.monotonic()
+        if wait > 0:
+            self.frame_timer.start(int(wait * 1000) + 1)
+        else:
+            self.deliver()
+
+    def deliver(self):
+        # Clear before reading so a batch that lands after the read raises a new wake-up
+        self.pending = False
+        self.last_delivery = time.monotonic()
+        heading, timestamp = self.sensor.get_latest()
+        if timestamp is not None:
+            self.heading_changed.emit(heading, timestamp)
+
+    def close(self):
+        self.sensor.remove_listener(self.on_samples)
+        self.sensor.remove_state_listener(self.on_state)
+        self.frame_timer.stop()
+        self.deleteLater()
@@ -0,0 +1,187 @@
+import os
+import selectors
+import socket
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import serial
+from metrics import log
+
+
+class SensorLoop:
+    """One reader thread servicing any number of SensorModule ports.
+
+    Ports that expose a file descriptor (POSIX serial devices) are waited on with a selector;
+    others (Windows COM ports, pyserial URL handlers) are polled every `poll_interval` seconds.
+    Ports are opened on a small worker pool so a slow open never stalls reading the others.
+    Ports that fail to open or drop out are retried with exponential backoff, starting at
+    `retry_interval` seconds and capped at `max_retry_interval`.
+    """
+
+    _default = None
+    _default_lock = threading.Lock()
+
+    def __init__(self, poll_interval=0.005, retry_interval=0.5, max_retry_interval=8.0):
+        self.poll_interval = poll_interval
+        self.retry_interval = retry_interval
+        self.max_retry_interval = max_retry_interval
+        self.selector = selectors.DefaultSelector()
+        self.connector = ThreadPoolExecutor(max_workers=4, thread_name_prefix="SensorConnect")
+        self.sensors = set()
+        self.polled = set()
+        self.connecting = set()
+        self.retry_at = {}
+        self.attempts = {}
+        self.commands = []
+        self.commands_lock = threading.Lock()
+        self._wake_r, self._wake_w = socket.socketpair()
+        self._wake_r.setblocking(False)
+        self._wake_w.setblocking(False)
+        self.selector.register(self._wake_r, selectors.EVENT_READ, None)
+        self.running = True
+        self.thread = threading.Thread(target=self.run, name="SensorLoop", daemon=True)
+        self.thread.start()
+
+    @classmethod
+    def default(cls):
+        """Loop shared by all SensorModules that do not get one explicitly."""
+        with cls._default_lock:
+            if cls._default is None or not cls._default.running or not cls._default.thread.is_alive():
+                cls._default = cls()
+            return cls._default
+
+    def call_soon(self, function, *args):
+        """Run function(*args) on the loop thread."""
+        with self.commands_lock:
+            self.commands.append((function, args))
+        try:
+            self._wake_w.send(b"\0")
+        except (BlockingIOError, OSError):
+            pass  # a wake-up is already pending
+
+    def add(self, sensor):
+        self.call_soon(self._add, sensor)
+
+    def remove(self, sensor, done=None):
+        self.call_soon(self._remove, sensor, done)
+
+    def stop(self):
+        self.running = False
+        self.call_soon(lambda: None)
+        self.thread.join()
+        self.connector.shutdown(wait=False)
+
+    def _add(self, sensor):
+        self.sensors.add(sensor)
+        self._open(sensor)
+
+    def _remove(self, sensor, done):
+        self._detach(sensor)
+        self.sensors.discard(sensor)
+        self.retry_at.pop(sensor, None)
+        self.attempts.pop(sensor, None)
+        sensor.close_serial()
+        # Nothing is fed any more, so the last chunk is already queued
+        sensor.stop_recording(wait=False)
+        sensor.set_state("stopped")
+        if done is not None:
+            done.set()
+
+    def _open(self, sensor):
+        self.retry_at.pop(sensor, None)
+        self.connecting.add(sensor)
+        sensor.set_state("connecting")
+        self.connector.submit(self._connect, sensor)
+
+    def _connect(self, sensor):
+        # Worker thread: opening can take a while on some drivers
+        self.call_soon(self._opened, sensor, sensor.connect_serial())
+
+    def _opened(self, sensor, ok):
+        self.connecting.discard(sensor)
+        if sensor not in self.sensors:
+            sensor.close_serial()  # stopped while the open was in progress
+            return
+        if not ok:
+            self._retry_later(sensor)
+            return
+        self.attempts.pop(sensor, None)
+        try:
+            fd = sensor.serial_connection.fileno()
+        except (AttributeError, OSError, serial.SerialException):
+            fd = None
+        if fd is None or os.name != "posix":
+            self.polled.add(sensor)
+        else:
+            self.selector.register(fd, selectors.EVENT_READ, sensor)
+        sensor.set_state("connected")
+
+    def _retry_later(self, sensor):
+        attempts = self.attempts.get(sensor, 0)
+        delay = min(self.max_retry_interval, self.retry_interval * 2 ** attempts)
+        self.attempts[sensor] = attempts + 1
+        self.retry_at[sensor] = time.monotonic() + delay
+        sensor.retry_delay = delay
+        sensor.set_state("retrying")
+
+    def _detach(self, sensor):
+        self.polled.discard(sensor)
+        for key in list(self.selector.get_map().values()):
+            if key.data is sensor:
+                self.selector.unregister(key.fileobj)
+
+    def _service(self, sensor):
+        try:
+            return sensor.read_serial_data()
+        except (serial.SerialException, OSError, TypeError) as e:
+            # TypeError: pyserial reading from a port that was closed underneath it
+            log(f"lost:{sensor.port}", f"Lost {sensor.port}: {e}")
+            self._detach(sensor)
+            sensor.close_serial()
+            self._retry_later(sensor)
+            return 0
+        except Exception as e:
+            # A bug in parsing or a pipeline must not stop the other ports on this thread
+            log(f"reader:{sensor.port}", f"Error reading {sensor.port}: {e!r}")
+            return 0
+
+    def _run_commands(self):
+        with self.commands_lock:
+            commands, self.commands = self.commands, []
+        for function, args in commands:
+            try:
+                function(*args)
+            except Exception as e:
+                log("loop_command", f"Sensor loop command {getattr(function, '__name__', function)} failed: {e!r}")
+
+    def _timeout(self):
+        if self.polled:
+            return self.poll_interval
+        if self.retry_at:
+            return max(0.0, min(self.retry_at.values()) - time.monotonic())
+        return None
+
+    def run(self):
+        while self.running:
+            for key, _ in self.selector.select(self._timeout()):
+                if key.data is None:
+                    try:
+                        while self._wake_r.recv(4096):
+                            pass
+                    except BlockingIOError:
+                        pass
+                else:
+                    self._service(key.data)
+            self._run_commands()
+            for sensor in list(self.polled):
+                self._service(sensor)
+            if self.retry_at:
+                now = time.monotonic()
+                for sensor, due in list(self.retry_at.items()):
+                    if due <= now:
+                        self._open(sensor)
+        for sensor in list(self.sensors):
+            self._remove(sensor, None)
+        self.selector.close()
+        self._wake_r.close()
+        self._wake_w.close()
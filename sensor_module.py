@@ -1,68 +1,343 @@
+import re
 import threading
 import serial
-import math
 import time
+import numpy as np
+from sensor_loop import SensorLoop
+from metrics import registry, log, MICROSECOND_BUCKETS
+
+# One parsed sample: arrival time (time.monotonic()), raw X/Y/Z and heading in degrees
+SAMPLE_DTYPE = np.dtype([
+    ("timestamp", np.float64),
+    ("x", np.float64),
+    ("y", np.float64),
+    ("z", np.float64),
+    ("heading", np.float64),
+])
+
+# Matches one "X: 190.44, Y: -438.84, Z: -177.56" record directly in the receive buffer.
+# Z is optional, like in the old line parser which only used X and Y.
+_NUMBER = rb"([-+.0-9eE]+)"
+FRAME_PATTERN = re.compile(
+    rb"X:[ \t]*" + _NUMBER +
+    rb"[ \t]*,[ \t]*Y:[ \t]*" + _NUMBER +
+    rb"(?:[ \t]*,[ \t]*Z:[ \t]*" + _NUMBER + rb")?"
+)
+# A run of complete X/Y/Z lines, which can be converted with one np.fromstring call
+_CLEAN_FIELD = rb"[ \t]*[-+.0-9eE]+[ \t]*"
+CLEAN_BATCH_PATTERN = re.compile(
+    rb"(?:X:" + _CLEAN_FIELD + rb",[ \t]*Y:" + _CLEAN_FIELD + rb",[ \t]*Z:" + _CLEAN_FIELD + rb"\r?\n)*"
+)
+
+# Drop the pending bytes if a device sends this much without a newline
+MAX_PENDING_BYTES = 64 * 1024
+
+BYTES_READ = registry.counter("sensor.bytes")
+LINES_READ = registry.counter("sensor.lines")
+SAMPLES_PARSED = registry.counter("sensor.samples")
+PARSE_ERRORS = registry.counter("sensor.parse_errors")
+DROPPED_BYTES = registry.counter("sensor.dropped_bytes")
+LOCK_WAIT = registry.histogram("sensor.lock_wait_us", MICROSECOND_BUCKETS)
+
+
+def compute_headings(x, y):
+    """Vectorized heading in degrees (0-360) from X/Y arrays."""
+    heading = np.degrees(np.arctan2(y, x))
+    heading[heading < 0] += 360
+    return heading
+
+
+def _parse_clean(buffer, start, end):
+    # Strip the labels and let NumPy convert a run of well-formed lines in one call
+    fields = bytes(buffer[start:end].translate(None, b"XYZ: \t\r").replace(b"\n", b","))
+    try:
+        values = np.fromstring(fields, sep=",")
+    except ValueError:
+        return None
+    if len(values) != 3 * buffer.count(b"\n", start, end):
+        return None
+    return values.reshape(-1, 3)
+
+
+def _parse_records(buffer, start, end):
+    rows = []
+    for match in FRAME_PATTERN.findall(buffer, start, end):
+        try:
+            rows.append([float(value) if value else np.nan for value in match])
+        except ValueError:
+            pass
+    return np.array(rows).reshape(-1, 3)
+
+
+def parse_frames(buffer, end=None):
+    """Parse every complete record in buffer[:end] into an (n, 3) float array of X, Y, Z.
+
+    Runs of well-formed lines go through the NumPy fast path; anything else is matched
+    record by record with FRAME_PATTERN.
+    """
+    if end is None:
+        end = len(buffer)
+    parts = []
+    position = 0
+    while position < end:
+        clean_end = CLEAN_BATCH_PATTERN.match(buffer, position, end).end()
+        if clean_end > position:
+            values = _parse_clean(buffer, position, clean_end)
+            parts.append(values if values is not None else _parse_records(buffer, position, clean_end))
+            position = clean_end
+        if position < end:
+            # One line the fast path does not accept
+            line_end = buffer.find(b"\n", position, end) + 1 or end
+            parts.append(_parse_records(buffer, position, line_end))
+            position = line_end
+    if not parts:
+        return np.empty((0, 3))
+    return parts[0] if len(parts) == 1 else np.concatenate(parts)
+
+
+class SampleBuffer:
+    """Fixed-size ring buffer of SAMPLE_DTYPE records."""
+
+    def __init__(self, capacity=4096):
+        self.capacity = capacity
+        self.data = np.zeros(capacity, dtype=SAMPLE_DTYPE)
+        self.count = 0  # total samples ever written
+
+    def __len__(self):
+        return min(self.count, self.capacity)
+
+    def extend(self, samples):
+        total = len(samples)
+        if total == 0:
+            return
+        if total > self.capacity:
+            samples = samples[-self.capacity:]
+        n = len(samples)
+        start = (self.count + total - n) % self.capacity
+        first = min(n, self.capacity - start)
+        self.data[start:start + first] = samples[:first]
+        self.data[:n - first] = samples[first:]
+        self.count += total
+
+    def ordered(self):
+        """Copy of the buffered samples, oldest first."""
+        if self.count <= self.capacity:
+            return self.data[:self.count].copy()
+        start = self.count % self.capacity
+        return np.concatenate((self.data[start:], self.data[:start]))
+
+    def after(self, count):
+        """Samples written after the first `count` ones (as far as they are still buffered)."""
+        n = min(self.count - count, self.capacity)
+        if n <= 0:
+            return self.data[:0].copy()
+        start = (self.count - n) % self.capacity
+        if start + n <= self.capacity:
+            return self.data[start:start + n].copy()
+        return np.concatenate((self.data[start:], self.data[:start + n - self.capacity]))
+
+    def since(self, timestamp=None):
+        samples = self.ordered()
+        if timestamp is None:
+            return samples
+        index = np.searchsorted(samples["timestamp"], timestamp, side="right")
+        return samples[index:]
+
 
 class SensorModule:
-    def __init__(self, port=None, baudrate=9600):
+    """Handle on one serial port. Reading happens on a shared SensorLoop thread.
+
+    With `source` (e.g. recording.ReplaySource) the bytes come from that instead of a port.
+    With `pipeline` (calibration.HeadingPipeline) headings are calibrated/smoothed per batch
+    instead of the plain atan2(y, x).
+    """
+
+    def __init__(self, port=None, baudrate=9600, buffer_size=4096, loop=None, source=None, pipeline=None):
         self.port = port
         self.baudrate = baudrate
         self.degree = 0
+        self.timestamp = None  # arrival time of the sample behind self.degree
         self.lock = threading.Lock()
         self.running = True
         self.serial_connection = None
-        self.thread = threading.Thread(target=self.read_serial_data, daemon=True)
-        self.connect_serial()
-        self.thread.start()
+        self.samples = SampleBuffer(buffer_size)
+        self.skipped_lines = 0
+        self._rx_buffer = bytearray()
+        self._last_error = None
+        self.state = "connecting"  # connecting, connected, retrying, stopped
+        self.retry_delay = None
+        self.listeners = []
+        self.state_listeners = []
+        self.recorder = None
+        self.pipeline = pipeline
+        self.source = source
+        if source is not None:
+            self.loop = None
+            source.attach(self)
+        else:
+            self.loop = loop or SensorLoop.default()
+            self.loop.add(self)
+
+    @property
+    def connected(self):
+        if self.source is not None:
+            return self.source.running
+        return bool(self.serial_connection and self.serial_connection.is_open)
 
     def connect_serial(self):
+        """Open the port without blocking reads. Called from the loop thread; returns True on success."""
         try:
-            self.serial_connection = serial.Serial(self.port, self.baudrate, timeout=0.2)
-            print(f"Connected to {self.port} at {self.baudrate} baud.")
+            # serial_for_url also accepts pyserial URLs such as loop:// or socket://host:port
+            self.serial_connection = serial.serial_for_url(self.port, self.baudrate, timeout=0)
+            print(f"Connected to {self.port} at {self.baudrate} baud.")  # rare, never rate-limited
+            self._last_error = None
+            return True
         except serial.SerialException as e:
-            print(f"Failed to connect to {self.port}: {e}")
-            self.running = False
+            # Only report a failure once until it changes, the loop keeps retrying
+            if str(e) != self._last_error:
+                log(f"connect_failed:{self.port}", f"Failed to connect to {self.port}: {e}")
+                self._last_error = str(e)
+            self.serial_connection = None
+            return False
+
+    def close_serial(self):
+        if self.serial_connection and self.serial_connection.is_open:
+            self.serial_connection.close()
+        self._rx_buffer.clear()
 
     def read_serial_data(self):
-        while self.running:
-            if self.serial_connection and self.serial_connection.is_open:
-                try:
-                    # Read a line from the serial port
-                    line = self.serial_connection.readline().decode('utf-8').strip()
-                    if "X:" not in line or "," not in line:
-                        continue
-                    elif line:
-                        try:
-                            x = float(line.split("X:")[1].split(",")[0].strip())
-                            y = float(line.split("Y:")[1].split(",")[0].strip())
-                            # Calculate the heading (degree) using atan2
-                            heading = math.atan2(y, x) * (180 / math.pi)
-                            # Normalize the heading to 0-360 degrees
-                            if heading < 0:
-                                heading += 360
-                            with self.lock:
-                                self.degree = heading
-                        except ValueError as e:
-                            print(f"Error parsing X, Y, Z values: {e}")
-                except (UnicodeDecodeError, serial.SerialException) as e:
-                    print(f"Error reading serial data: {e}")
-            else:
-                print("Serial connection is not open.")
-                time.sleep(1)
+        """Drain everything the port has received and parse it. Returns the number of bytes read."""
+        data = self.serial_connection.read(max(1, self.serial_connection.in_waiting))
+        if data:
+            self.feed(data)
+        return len(data)
+
+    def feed(self, data, timestamp=None):
+        """Append received bytes, parse all complete lines and store the samples. Returns the sample count."""
+        if timestamp is None:
+            timestamp = time.monotonic()
+        recorder = self.recorder
+        if recorder is not None:
+            recorder.write_raw(timestamp, data)
+        BYTES_READ.add(len(data))
+        rx = self._rx_buffer
+        rx += data
+        end = rx.rfind(b"\n") + 1
+        if end == 0:
+            if len(rx) > MAX_PENDING_BYTES:
+                DROPPED_BYTES.add(len(rx))
+                log("discard", f"Discarding {len(rx)} bytes without a line break.")
+                del rx[:]
+            return 0
+
+        xyz = parse_frames(rx, end)
+        lines = rx.count(b"\n", 0, end)
+        del rx[:end]
+        skipped = max(0, lines - len(xyz))
+        self.skipped_lines += skipped
+        LINES_READ.add(lines)
+        PARSE_ERRORS.add(skipped)
+        SAMPLES_PARSED.add(len(xyz))
+        if len(xyz) == 0:
+            return 0
+
+        batch = np.empty(len(xyz), dtype=SAMPLE_DTYPE)
+        batch["timestamp"] = timestamp
+        batch["x"] = xyz[:, 0]
+        batch["y"] = xyz[:, 1]
+        batch["z"] = xyz[:, 2]
+        if self.pipeline is not None:
+            batch["heading"] = self.pipeline.process(xyz)
+        else:
+            batch["heading"] = compute_headings(xyz[:, 0], xyz[:, 1])
+        with self.lock:
+            self.samples.extend(batch)
+            self.degree = float(batch["heading"][-1])
+            self.timestamp = timestamp
+        if recorder is not None:
+            recorder.write_samples(timestamp, batch)
+        for listener in self.listeners:
+            try:
+                listener(self)
+            except Exception as e:
+                # Reader thread: a failing subscriber must not take the port (or the loop) down
+                log(f"listener:{self.port}", f"Listener error on {self.port}: {e!r}")
+        return len(batch)
+
+    def add_listener(self, callback):
+        """Call callback(sensor) from the reader thread after each parsed batch."""
+        self.listeners = self.listeners + [callback]
+
+    def remove_listener(self, callback):
+        self.listeners = [listener for listener in self.listeners if listener != callback]
+
+    def add_state_listener(self, callback):
+        """Call callback(sensor, state) from the loop thread when the connection state changes."""
+        self.state_listeners = self.state_listeners + [callback]
+
+    def remove_state_listener(self, callback):
+        self.state_listeners = [listener for listener in self.state_listeners if listener != callback]
+
+    def set_state(self, state):
+        self.state = state
+        for listener in self.state_listeners:
+            try:
+                listener(self, state)
+            except Exception as e:
+                log(f"listener:{self.port}", f"State listener error on {self.port}: {e!r}")
+
+    def start_recording(self, path):
+        """Log raw input and parsed samples to a binary recording (see recording.py)."""
+        from recording import Recorder
+        self.stop_recording()
+        self.recorder = Recorder(path)
+
+    def stop_recording(self, wait=True):
+        """Stop recording; with wait=False the file is finished by the recorder's own thread."""
+        recorder, self.recorder = self.recorder, None
+        if recorder is not None:
+            recorder.close(wait)
 
     def get_degree(self):
+        start = time.perf_counter()
         with self.lock:
+            LOCK_WAIT.add((time.perf_counter() - start) * 1e6)
             return self.degree
 
-    def stop(self):
-        self.running = False
-        if self.serial_connection and self.serial_connection.is_open:
-            self.serial_connection.close()
-        self.thread.join()
+    def get_latest(self):
+        """Latest heading and its arrival timestamp (None before the first sample)."""
+        start = time.perf_counter()
+        with self.lock:
+            LOCK_WAIT.add((time.perf_counter() - start) * 1e6)
+            return self.degree, self.timestamp
 
+    def get_samples(self, since=None):
+        """Buffered samples (SAMPLE_DTYPE array, oldest first) newer than the `since` timestamp."""
+        with self.lock:
+            return self.samples.since(since)
+
+    def get_new_samples(self, count):
+        """Samples after the first `count` ever received, and the new total to pass next time."""
+        with self.lock:
+            return self.samples.after(count), self.samples.count
+
+    def stop(self, timeout=1.0):
+        """Close the port on the loop thread; waits at most `timeout` seconds (0 = do not wait).
+
+        The recording is closed once no more data can arrive (by the loop thread after the port
+        is detached), without waiting for the recorder to write out its queue.
+        """
+        self.running = False
+        if self.source is not None:
+            self.source.stop()
+            self.stop_recording(wait=False)
+        else:
+            done = threading.Event()
+            self.loop.remove(self, done)
+            done.wait(timeout)
 
 # Create a global instance of the SensorModule
 # sensor = SensorModule()
 
 # def get_sensor_degree():
-#     return sensor.get_degree()
\ No newline at end of file
+#     return sensor.get_degree()
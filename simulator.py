@@ -0,0 +1,163 @@
+"""Magnetometer simulator writing "X: .., Y: .., Z: .." lines without any hardware.
+
+Targets:
+  --pty         create a pseudo-terminal pair (Linux/macOS) and print the port to open
+  --port NAME   write to an existing port or pyserial URL (COM1, /dev/ttyUSB0, socket://...)
+In code, Simulator(...).attach(sensor) writes straight into a SensorModule opened on "loop://".
+
+Usage: python simulator.py --pty --rate 1000 --noise 5 --malformed 0.01 --burst 10
+"""
+import argparse
+import math
+import os
+import random
+import threading
+import time
+import serial
+
+
+class Simulator:
+    """Generates a slowly turning field with optional noise, malformed lines and bursts.
+
+    rate      : average lines per second
+    baud      : if set, writes are paced to what a real UART at that baud rate can carry
+    noise     : standard deviation added to X/Y/Z, in the same units as `magnitude`
+    malformed : fraction of lines replaced by broken ones
+    burst     : lines written back to back per write (average rate stays `rate`)
+    rotation  : degrees per second the simulated heading turns
+    """
+
+    def __init__(self, rate=100.0, baud=None, noise=0.0, malformed=0.0, burst=1, rotation=36.0,
+                 magnitude=400.0, seed=None):
+        self.rate = rate
+        self.baud = baud
+        self.noise = noise
+        self.malformed = malformed
+        self.burst = max(1, int(burst))
+        self.rotation = rotation
+        self.magnitude = magnitude
+        self.random = random.Random(seed)
+        self.sequence = 0
+        self.sent_lines = 0
+        self.sent_malformed = 0
+        self.send_times = []  # time.monotonic() of every valid line, if track_times
+        self.track_times = False
+        self.write = None
+        self.running = False
+        self.thread = None
+        self.master = None
+
+    def open_pty(self):
+        """Create a pseudo-terminal pair, write to the master side and return the slave port name."""
+        import tty
+        self.master, slave = os.openpty()
+        tty.setraw(slave)
+        self._slave = slave
+        self.write = lambda data: os.write(self.master, data)
+        return os.ttyname(slave)
+
+    def open_port(self, port):
+        connection = serial.serial_for_url(port, self.baud or 115200)
+        self.write = connection.write
+        return connection
+
+    def attach(self, sensor):
+        """Write into a SensorModule opened on "loop://" (its port object echoes what is written)."""
+        while not sensor.connected:
+            time.sleep(0.01)
+        self.write = sensor.serial_connection.write
+
+    def heading(self):
+        return (self.sequence / self.rate * self.rotation) % 360.0
+
+    def line(self):
+        angle = math.radians(self.heading())
+        self.sequence += 1
+        if self.malformed and self.random.random() < self.malformed:
+            self.sent_malformed += 1
+            return self.random.choice((
+                b"X: 190.44, Y:\n",
+                b"X: abc, Y: def, Z: ghi\n",
+                b"\xff\xfe\x00garbage\n",
+                b"Y: -438.84, Z: -177.56\n",
+            ))
+        gauss = self.random.gauss
+        x = math.cos(angle) * self.magnitude + (gauss(0, self.noise) if self.noise else 0.0)
+        y = math.sin(angle) * self.magnitude + (gauss(0, self.noise) if self.noise else 0.0)
+        z = -177.56 + (gauss(0, self.noise) if self.noise else 0.0)
+        return f"X: {x:.2f}, Y: {y:.2f}, Z: {z:.2f}\n".encode()
+
+    def run(self, duration=None, count=None):
+        """Write lines until stop(), `duration` seconds or `count` lines."""
+        self.running = True
+        start = time.monotonic()
+        next_write = start
+        burst_interval = self.burst / self.rate
+        byte_time = 10.0 / self.baud if self.baud else 0.0  # 8N1: 10 bits per byte
+        while self.running:
+            if duration is not None and time.monotonic() - start >= duration:
+                break
+            lines = self.burst if count is None else min(self.burst, count - self.sent_lines)
+            if lines <= 0:
+                break
+            malformed = self.sent_malformed
+            chunk = b"".join(self.line() for _ in range(lines))
+            written = time.monotonic()
+            self.write(chunk)
+            if self.track_times:
+                self.send_times.extend([written] * (lines - (self.sent_malformed - malformed)))
+            self.sent_lines += lines
+            next_write += max(burst_interval, len(chunk) * byte_time)
+            delay = next_write - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+        self.running = False
+
+    def start(self, duration=None, count=None):
+        self.thread = threading.Thread(target=self.run, args=(duration, count), name="Simulator", daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.running = False
+        if self.thread is not None:
+            self.thread.join()
+
+    def close(self):
+        self.stop()
+        if self.master is not None:
+            os.close(self.master)
+            os.close(self._slave)
+            self.master = None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    target = parser.add_mutually_exclusive_group(required=True)
+    target.add_argument("--pty", action="store_true", help="create a pseudo-terminal to read from")
+    target.add_argument("--port", help="existing serial port or pyserial URL")
+    parser.add_argument("--rate", type=float, default=100.0, help="lines per second")
+    parser.add_argument("--baud", type=int, default=None, help="pace writes like a UART at this baud rate")
+    parser.add_argument("--noise", type=float, default=0.0, help="std. deviation added to X/Y/Z")
+    parser.add_argument("--malformed", type=float, default=0.0, help="fraction of broken lines")
+    parser.add_argument("--burst", type=int, default=1, help="lines per write")
+    parser.add_argument("--rotation", type=float, default=36.0, help="degrees per second")
+    parser.add_argument("--duration", type=float, default=None, help="seconds to run (default: forever)")
+    args = parser.parse_args()
+
+    simulator = Simulator(rate=args.rate, baud=args.baud, noise=args.noise, malformed=args.malformed,
+                          burst=args.burst, rotation=args.rotation)
+    if args.pty:
+        print(f"Simulating on {simulator.open_pty()}", flush=True)
+    else:
+        simulator.open_port(args.port)
+        print(f"Simulating on {args.port}", flush=True)
+    try:
+        simulator.run(duration=args.duration)
+    except KeyboardInterrupt:
+        pass
+    print(f"Sent {simulator.sent_lines} lines ({simulator.sent_malformed} malformed).")
+    simulator.close()
+
+
+if __name__ == "__main__":
+    main()
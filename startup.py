@@ -0,0 +1,81 @@
+"""Time-to-first-frame measurement. Import this first so `started` is as early as possible."""
+import json
+import os
+import sys
+import time
+
+started = time.monotonic()
+marks = {}
+
+
+def _process_age_linux(pid):
+    with open(f"/proc/{pid}/stat") as f:
+        fields = f.read().rsplit(")", 1)[1].split()
+    start_ticks = int(fields[19])  # field 22 (starttime), counted after the ")" of the name
+    with open("/proc/uptime") as f:
+        uptime = float(f.read().split()[0])
+    return uptime - start_ticks / os.sysconf("SC_CLK_TCK")
+
+
+def _process_age_windows(pid):
+    import ctypes
+    from ctypes import wintypes
+    kernel32 = ctypes.windll.kernel32
+    handle = kernel32.OpenProcess(0x1000, False, pid)  # PROCESS_QUERY_LIMITED_INFORMATION
+    if not handle:
+        return None
+    try:
+        creation, exit_time, kernel, user = (wintypes.FILETIME() for _ in range(4))
+        if not kernel32.GetProcessTimes(handle, ctypes.byref(creation), ctypes.byref(exit_time),
+                                        ctypes.byref(kernel), ctypes.byref(user)):
+            return None
+        now = wintypes.FILETIME()
+        kernel32.GetSystemTimeAsFileTime(ctypes.byref(now))
+        to_int = lambda t: (t.dwHighDateTime << 32) | t.dwLowDateTime
+        return (to_int(now) - to_int(creation)) / 1e7  # 100 ns units
+    finally:
+        kernel32.CloseHandle(handle)
+
+
+def launch_pid():
+    """PID whose start counts as the launch: the bootloader parent for a PyInstaller --onefile exe."""
+    meipass = getattr(sys, "_MEIPASS", None)
+    if getattr(sys, "frozen", False) and meipass and os.path.basename(meipass).startswith("_MEI"):
+        return os.getppid()
+    return os.getpid()
+
+
+def process_age():
+    """Seconds since launch (see launch_pid), or None where that cannot be read."""
+    try:
+        if sys.platform.startswith("linux"):
+            return _process_age_linux(launch_pid())
+        if sys.platform == "win32":
+            return _process_age_windows(launch_pid())
+    except (OSError, ValueError, IndexError, AttributeError):
+        pass
+    return None
+
+
+def mark(name):
+    """Remember when a startup step finished (first call wins)."""
+    marks.setdefault(name, time.monotonic())
+
+
+def report(path=None):
+    """Print the startup timings and, if `path` is given, append them to it as one JSON line."""
+    age = process_age()
+    now = time.monotonic()
+    result = {
+        "frozen": bool(getattr(sys, "frozen", False)),
+        "launch_to_python_s": None if age is None else age - (now - started),
+    }
+    for name, when in marks.items():
+        result[f"python_to_{name}_s"] = when - started
+        if age is not None:
+            result[f"launch_to_{name}_s"] = age - (now - when)
+    print("Startup: " + ", ".join(f"{k}={v:.3f}" for k, v in result.items() if isinstance(v, float)))
+    if path:
+        with open(path, "a") as f:
+            f.write(json.dumps(result) + "\n")
+    return result